@@ -0,0 +1,77 @@
+"""Messages per second through on_message's chat command dispatch.
+
+Runs the real on_message with fake mention messages. The command coroutines
+and the AI reply are replaced with no-ops, so this measures routing only.
+
+    python benchmarks/chat_dispatch.py [messages]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+SAMPLES = [
+    "play never gonna give you up",
+    "skip this one please",
+    "what do you think about the queue",
+    "volume 40",
+    "loop queue",
+    "hey miku how was your day? I was thinking about quitting my job lol",
+    "now playing?",
+    "remove 3",
+    "you are so quiet today, are you okay",
+    "unpause",
+]
+
+
+class FakeUser:
+    id = 1
+    bot = True  # Keeps bot.process_commands() from parsing prefix commands
+
+
+class FakeChannel:
+    id = 2
+
+
+class FakeMessage:
+    reference = None
+
+    def __init__(self, content):
+        self.content = f"<@{FakeUser.id}> {content}"
+        self.mentions = [FakeUser]
+        self.author = FakeUser()
+        self.guild = None
+        self.channel = FakeChannel()
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+async def run(count):
+    main.bot._connection.user = FakeUser
+    for route in main.chat_router.routes:
+        route.handler = noop
+    main.respond_with_ai = noop
+
+    messages = [FakeMessage(SAMPLES[i % len(SAMPLES)]) for i in range(count)]
+    start = time.perf_counter()
+    for message in messages:
+        await main.on_message(message)
+    elapsed = time.perf_counter() - start
+
+    router_start = time.perf_counter()
+    for message in messages:
+        main.chat_router.match(message.content)
+    router_elapsed = time.perf_counter() - router_start
+
+    print(f"on_message:         {count / elapsed:12,.0f} msg/s")
+    print(f"chat_router.match:  {count / router_elapsed:12,.0f} msg/s")
+
+
+if __name__ == '__main__':
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -0,0 +1,81 @@
+"""Stand-in for one cluster process that never connects to Discord.
+
+`python cluster.py --fake-gateway` runs this instead of main.py. It imports the
+real bot with the shard settings the launcher passed in, installs the fakes
+from benchmarks/fakes.py and gives each of its shards a few fake guilds. The
+guilds keep playing searches from a small shared pool, so the launcher's
+supervision and restarts, the shared search/stream caches and the aggregated
+/health and /metrics can all be exercised locally.
+
+    FAKE_GUILDS_PER_SHARD=3   fake guilds on each shard
+    FAKE_TRACK_SECONDS=10     how long each fake track "plays"
+    FAKE_CRASH_AFTER=0        exit with an error after this many seconds (tests restarts)
+"""
+import asyncio
+import functools
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['EXTRACT_POOL'] = 'thread'  # The fakes are patched into this process only
+os.environ['QUEUE_SNAPSHOTS'] = '0'  # Restoring needs real guilds and channels
+
+import main  # noqa: E402
+import metrics  # noqa: E402
+import fakes  # noqa: E402
+from keep_alive import keep_alive  # noqa: E402
+
+SONGS = [f"fake song {i}" for i in range(40)]  # Small pool: clusters often search the same songs
+
+
+def guild_ids():
+    """Fake guild IDs whose shard ((id >> 22) % SHARD_COUNT) is one of this process's shards"""
+    per_shard = int(os.getenv('FAKE_GUILDS_PER_SHARD', '3'))
+    shard_count = main.SHARD_COUNT or 1
+    return [((k * shard_count + shard) << 22) | 1
+            for shard in main.SHARD_IDS or range(shard_count) for k in range(1, per_shard + 1)]
+
+
+async def keep_playing(ctx):
+    guild_player = main.get_player(ctx.guild.id)
+    await asyncio.sleep(random.uniform(0, 3))  # Don't start every guild in the same tick
+    while True:
+        try:
+            await main.play(ctx, query=random.choice(SONGS))
+        except Exception as e:
+            print(f"Fake guild {ctx.guild.id}: {e}")
+        while guild_player.current is not None or guild_player.queue:
+            await asyncio.sleep(0.5)
+        await asyncio.sleep(random.uniform(0.5, 3))
+
+
+def health(contexts):
+    return {**main.bot_health(),
+            'ready': True,
+            'guilds': len(contexts),
+            'voice_connections': sum(ctx.voice_client is not None for ctx in contexts)}
+
+
+async def run():
+    fakes.Latency.track = float(os.getenv('FAKE_TRACK_SECONDS', '10'))
+    fakes.install(main)
+    metrics.set_loop(asyncio.get_running_loop())
+    if main.loop_monitor is not None:
+        main.loop_monitor.start()
+
+    contexts = [fakes.FakeCtx(guild_id) for guild_id in guild_ids()]
+    keep_alive(host=os.getenv('KEEP_ALIVE_HOST', '127.0.0.1'), port=int(os.getenv('KEEP_ALIVE_PORT', '8080')),
+               health=functools.partial(metrics.on_loop, functools.partial(health, contexts)))
+    print(f"Fake cluster {main.CLUSTER_ID}: shards {main.SHARD_IDS}, {len(contexts)} guilds")
+    tasks = [asyncio.create_task(keep_playing(ctx)) for ctx in contexts]
+    crash_after = float(os.getenv('FAKE_CRASH_AFTER', '0'))
+    if crash_after:
+        await asyncio.sleep(crash_after)
+        print(f"Fake cluster {main.CLUSTER_ID}: crashing on purpose")
+        os._exit(1)
+    await asyncio.gather(*tasks)
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -0,0 +1,278 @@
+"""Offline stand-ins for yt-dlp, Spotify, Gemini and Discord voice, with configurable latencies.
+
+install() patches them into main so the real play()/play_next()/on_message
+code runs without network access or ffmpeg. Latencies are in seconds.
+"""
+import asyncio
+import re
+import time
+
+import discord
+
+_count = re.compile(r'[NL](\d+)', re.IGNORECASE)  # Chat commands arrive lowercased
+
+VIDEO_SECONDS = 180
+FRAME = b'\0' * 3840  # 20ms of 48kHz stereo s16le
+
+
+class Latency:
+    extract = 0.05  # One yt-dlp extract_info (search or video page)
+    playlist_page = 0.2  # Each 100-entry page of a flat playlist listing
+    spotify = 0.1  # One Spotify API call
+    gemini = 0.8  # Full Gemini reply (streamed replies spread it over their chunks)
+    track = 0.2  # How long the fake voice client "plays" each track
+
+
+def video(video_id, title=None):
+    return {
+        'id': video_id,
+        'title': title or f"Video {video_id}",
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+        'url': f"https://rr1---sn-fake.googlevideo.com/videoplayback?id={video_id}&expire={int(time.time()) + 21600}",
+        'acodec': 'opus',
+        'abr': 128,
+        'duration': VIDEO_SECONDS,
+        'thumbnail': f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+    }
+
+
+class FakeYoutubeDL:
+    """yt_dlp.YoutubeDL: ytsearch:, watch?v= and playlist?list=N<count> URLs"""
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def extract_info(self, url, download=False, process=True):
+        if 'list=' in url:
+            total = int(_count.search(url.split('list=')[1]).group(1))
+            return {'_type': 'playlist', 'id': 'playlist', 'entries': self._entries(total)}
+        time.sleep(Latency.extract)
+        if url.startswith('ytsearch:'):
+            term = url[len('ytsearch:'):]
+            return {'_type': 'playlist', 'entries': [video(f"s{abs(hash(term)) % 10 ** 10}", term)]}
+        return video(url.rsplit('v=', 1)[-1])
+
+    def _entries(self, total):
+        for i in range(total):
+            if i % 100 == 0:
+                time.sleep(Latency.playlist_page)
+            yield {'_type': 'url', 'ie_key': 'Youtube', 'id': f"p{i}", 'title': f"Playlist video {i}",
+                   'url': f"https://www.youtube.com/watch?v=p{i}", 'duration': VIDEO_SECONDS,
+                   'thumbnails': [{'url': f"https://i.ytimg.com/vi/p{i}/hqdefault.jpg"}]}
+
+    @staticmethod
+    def sanitize_info(info):
+        return info
+
+
+class FakeSpotify:
+    """spotipy.Spotify: playlist/album URLs ending in N<count>"""
+
+    def _page(self, url, limit, offset, wrap):
+        time.sleep(Latency.spotify)
+        total = int(_count.search(url.rsplit('/', 1)[-1]).group(1))
+        items = [{'name': f"Song {i}", 'artists': [{'name': "Artist"}]} for i in range(offset, min(offset + limit, total))]
+        return {'items': [wrap(item) for item in items], 'total': total}
+
+    def playlist_items(self, url, fields=None, limit=100, offset=0, additional_types=None):
+        return self._page(url, limit, offset, lambda item: {'track': item})
+
+    def album_tracks(self, url, limit=50, offset=0):
+        return self._page(url, limit, offset, lambda item: item)
+
+    def track(self, url):
+        time.sleep(Latency.spotify)
+        return {'name': "Song 0", 'artists': [{'name': "Artist"}]}
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(Latency.gemini / len(self.chunks))
+            yield _Response(chunk)
+
+
+class FakeGemini:
+    """genai.GenerativeModel.generate_content_async, optionally streamed in 5 chunks"""
+
+    REPLY = "Ugh, that sounds exhausting~ 😤 You deserve a break, seriously! Maybe put on something chill? 🎧💖"
+
+    async def generate_content_async(self, contents, stream=False):
+        if stream:
+            size = len(self.REPLY) // 5 + 1
+            return _Stream([self.REPLY[i:i + size] for i in range(0, len(self.REPLY), size)])
+        await asyncio.sleep(Latency.gemini)
+        return _Response(self.REPLY)
+
+
+class FakePCMAudio(discord.AudioSource):
+    """discord.FFmpegPCMAudio without ffmpeg: silence, no subprocess"""
+
+    def __init__(self, source, **kwargs):
+        self.source = source
+
+    def read(self):
+        return FRAME
+
+    def cleanup(self):
+        pass
+
+
+class FakeVoiceClient:
+    """Plays each source for Latency.track seconds, then runs its after-callback like discord's player thread"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.source = None
+        self.started = []  # monotonic time of every play() call
+        self._after = None
+        self._timer = None
+        self._paused = False
+
+    def is_playing(self):
+        return self._timer is not None and not self._paused
+
+    def is_paused(self):
+        return self._timer is not None and self._paused
+
+    def play(self, source, *, after=None):
+        self.source = source
+        self._after = after
+        self._paused = False
+        self.started.append(time.monotonic())
+        source.read()
+        self._timer = asyncio.get_running_loop().call_later(Latency.track, self._finish)
+
+    def _finish(self, error=None):
+        self._timer = None
+        if self._after is not None:
+            self._after(error)
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._finish()
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.channel.guild.voice_client = None
+
+
+class FakeSent:
+    def __init__(self, content=None, embed=None, view=None):
+        self.content = content
+        self.embed = embed
+        self.view = view
+
+    async def edit(self, *, content=None, embed=None, view=None):
+        self.content = content
+        self.embed = embed
+        self.view = view
+
+
+class _Typing:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id=2):
+        self.guild = guild
+        self.id = channel_id
+        self.sent = 0
+        self.last = None  # The most recent FakeSent
+
+    async def send(self, content=None, *, embed=None, view=None):
+        self.sent += 1
+        self.last = FakeSent(content, embed, view)
+        return self.last
+
+    def typing(self):
+        return _Typing()
+
+    async def connect(self):
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.voice_client = None
+        self.members = []
+
+
+class FakeMember:
+    bot = True  # Keeps bot.process_commands() from parsing prefix commands
+
+    def __init__(self, member_id, name, channel=None):
+        self.id = member_id
+        self.name = self.display_name = name
+        self.mention = f"<@{member_id}>"
+        self.voice = type('VoiceState', (), {'channel': channel})() if channel else None
+
+    async def timeout(self, until):
+        pass
+
+
+class FakeCtx:
+    """commands.Context for a member sitting in a voice channel"""
+
+    def __init__(self, guild_id):
+        self.guild = FakeGuild(guild_id)
+        self.channel = FakeChannel(self.guild)
+        self.author = FakeMember(1, "Aki", self.channel)
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, *, embed=None, view=None):
+        return await self.channel.send(content, embed=embed, view=view)
+
+    def typing(self):
+        return self.channel.typing()
+
+
+class FakeMessage:
+    reference = None
+
+    def __init__(self, bot_user, ctx, content):
+        self.content = f"<@{bot_user.id}> {content}"
+        self.mentions = [bot_user]
+        self.author = ctx.author
+        self.guild = ctx.guild
+        self.channel = ctx.channel
+
+    async def reply(self, content=None, *, embed=None):
+        return await self.channel.send(content, embed=embed)
+
+
+def install(main):
+    """Swap every network/ffmpeg dependency main uses for the fakes above"""
+    import extractor
+    extractor.yt_dlp.YoutubeDL = FakeYoutubeDL
+    main.discord.FFmpegPCMAudio = FakePCMAudio
+    main.OPUS_PASSTHROUGH = False  # The Opus path spawns ffmpeg in its constructor
+    main.spotify.client_id, main.spotify.client_secret = 'fake', 'fake'
+    main.spotify._sp = FakeSpotify()
+    main.model = main.summary_model = FakeGemini()
+    main.bot.loop = asyncio.get_running_loop()
+    main.bot._connection.user = FakeMember(999, "Miku")
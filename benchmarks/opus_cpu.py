@@ -0,0 +1,78 @@
+"""CPU cost per stream of the Opus passthrough path vs the PCM path.
+
+Plays a generated Opus track through each source type as fast as ffmpeg can
+feed it and reports CPU seconds (bot process + ffmpeg child) per minute of
+audio. Needs ffmpeg on PATH; the PCM row includes discord.py's libopus
+encoding only if libopus can be loaded.
+
+    python benchmarks/opus_cpu.py [seconds_of_audio]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+import main  # noqa: E402
+
+
+def cpu_now():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time(), children.ru_utime + children.ru_stime
+
+
+def drain(source, encoder=None):
+    while True:
+        frame = source.read()
+        if not frame:
+            break
+        if encoder is not None:
+            encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+    source.cleanup()
+
+
+def measure(name, make_source, encoder=None):
+    before = cpu_now()
+    drain(make_source(), encoder)
+    after = cpu_now()
+    return name, after[0] - before[0], after[1] - before[1]
+
+
+def run(seconds):
+    main.ffmpeg_opts['before_options'] = '-nostdin'  # Local file, no reconnect flags
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'track.webm')
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi',
+                        '-i', f'sine=frequency=440:duration={seconds}', '-ac', '2', '-ar', '48000',
+                        '-c:a', 'libopus', '-b:a', '128k', path], check=True)
+        data = {'url': path, 'acodec': 'opus', 'title': 'benchmark'}
+
+        encoder = None
+        try:
+            discord.opus._load_default()
+            encoder = discord.opus.Encoder()
+        except Exception:
+            print('libopus not loadable: PCM row excludes the Opus encode done by discord.py')
+
+        rows = [
+            measure('opus passthrough (copy, 100%)',
+                    lambda: main.YTDLOpusSource(path, data=data, volume=1.0)),
+            measure('opus re-encode in ffmpeg (50%)',
+                    lambda: main.YTDLOpusSource(path, data=data, volume=0.5)),
+            measure('pcm + PCMVolumeTransformer (50%)',
+                    lambda: main.YTDLSource(discord.FFmpegPCMAudio(path, **main.ffmpeg_opts), data=data, volume=0.5),
+                    encoder),
+        ]
+
+    print(f"{'path':36} {'bot cpu/min':>12} {'ffmpeg cpu/min':>15} {'total cpu/min':>14}")
+    for name, own, child in rows:
+        scale = 60 / seconds
+        print(f"{name:36} {own * scale:11.3f}s {child * scale:14.3f}s {(own + child) * scale:13.3f}s")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 180)
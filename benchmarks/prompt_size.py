@@ -0,0 +1,80 @@
+"""Size of one Gemini chat request, before and after moving to a system instruction + budgeted history.
+
+"before" rebuilds the old single prompt: persona, music status and the last
+20 history lines joined into one f-string. "after" is what
+generate_ai_response() sends now: the persona as system_instruction plus the
+structured turns the conversation store kept, with the running summary in
+the last turn. No API calls are made; the summary stands in at a typical
+length. Tokens are estimated at ~4 characters each.
+
+    python benchmarks/prompt_size.py
+"""
+import os
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from conversation_store import ConversationStore, estimate_tokens  # noqa: E402
+
+USER_LINES = [
+    "hey miku how was your day?",
+    "I was thinking about quitting my job lol, my boss keeps making me stay late and I'm tired of it",
+    "what anime should I watch next, I just finished frieren and loved it",
+    "lol ok",
+    "can you recommend some songs like the ones in the queue? something chill for studying tonight",
+]
+REPLY = "Ugh, that sounds exhausting~ 😤 You deserve a break, seriously! Maybe put on something chill and take a breather first? 🎧💖 Tell me more if you want!"
+MUSIC = "Currently playing: Lofi Hip Hop Radio. Queue has 12 songs. Loop mode: off."
+SUMMARY = ("Aki is tired of their job and thinking of quitting; Miku suggested chill music and a break. "
+           "They just finished Frieren and want anime and study-music recommendations. Mood: tired but friendly.")
+
+
+def before(history, message):
+    history_str = "\n".join(history) if history else "No previous conversation."
+    prompt = f"""{main.MIKU_PERSONA}
+
+        Music Status: {MUSIC}
+
+        Conversation History:
+        {history_str}
+
+        User Aki said: {message}
+
+        Respond as Miku:"""
+    return len(prompt)
+
+
+def after(summary, turns, message):
+    context = f"Music Status: {MUSIC}"
+    if summary:
+        context += f"\nEarlier in this chat: {summary}"
+    texts = [text for _, text in turns] + [f"{context}\n\nAki: {message}"]
+    return len(main.MIKU_PERSONA), sum(len(text) for text in texts)
+
+
+def run():
+    print(f"{'exchanges':>9} | {'before chars':>12} {'~tokens':>8} | {'after chars':>11} {'~tokens':>8} "
+          f"(system {'':>4} + turns) | {'change':>7}")
+    for exchanges in (1, 5, 10, 20, 50):
+        old_history = deque(maxlen=20)
+        store = ConversationStore(max_tokens=main.conversations.max_tokens)
+        summary = ''
+        for i in range(exchanges):
+            message = USER_LINES[i % len(USER_LINES)]
+            if i == exchanges - 1:
+                old_size = before(list(old_history) + [f"User Aki: {message}"], message)
+                system, turns_size = after(summary, store.get('k')[1], message)
+                break
+            old_history.append(f"User Aki: {message}")
+            old_history.append(f"Miku: {REPLY}")
+            if store.append('k', ('user', f"Aki: {message}"), ('model', REPLY)):
+                summary = SUMMARY
+        new_size = system + turns_size
+        print(f"{exchanges:>9} | {old_size:>12,} {estimate_tokens('x' * old_size):>8,} | {new_size:>11,} "
+              f"{estimate_tokens('x' * new_size):>8,} ({system:>6,} + {turns_size:>5,}) | {(new_size - old_size) / old_size:>+7.0%}")
+
+
+if __name__ == '__main__':
+    run()
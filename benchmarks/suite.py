@@ -0,0 +1,391 @@
+"""Offline benchmark suite for the play pipeline, queue commands and chat dispatch.
+
+Runs the real play(), play_next(), queue commands and on_message against the
+fakes in benchmarks/fakes.py (yt-dlp, Spotify, Gemini and the voice client
+are replaced; nothing touches the network or ffmpeg) and prints the results
+as JSON. Compare the JSON between releases to catch regressions.
+
+    python benchmarks/suite.py [--out results.json] [--extract-latency 0.05] ...
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import deque
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SEARCH_CACHE_PATH', ':memory:')
+os.environ['EXTRACT_POOL'] = 'thread'  # The fakes are patched into this process only
+os.environ.setdefault('QUEUE_SNAPSHOTS', '0')
+
+import main  # noqa: E402
+import fakes  # noqa: E402
+from track_queue import TrackQueue  # noqa: E402
+from member_index import MemberIndex  # noqa: E402
+
+PLAYLIST_SIZES = (10, 100, 1000)
+QUEUE_SIZES = (10_000, 100_000)  # 24/7 radio guilds pile up very long queues
+GUILD_SIZES = (1000, 50_000)
+CHAT_SAMPLES = [
+    "what's in the queue",
+    "loop queue",
+    "volume 40",
+    "now playing?",
+    "remove 3",
+    "hey miku how was your day? I was thinking about quitting my job lol",
+    "you are so quiet today, are you okay",
+    "shuffle it up",
+]
+
+_guild_ids = iter(range(1000, 10 ** 9))
+
+
+def new_ctx():
+    return fakes.FakeCtx(next(_guild_ids))
+
+
+class CountingQueue(TrackQueue):
+    """Counts the tracks fills put in, including one play_next has popped but not started yet"""
+
+    def __init__(self):
+        self.added = 0
+        super().__init__()
+
+    def append(self, track):
+        self.added += 1
+        super().append(track)
+
+    def extend(self, tracks):
+        tracks = list(tracks)
+        self.added += len(tracks)
+        super().extend(tracks)
+
+
+async def until(condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("benchmark scenario did not finish")
+        await asyncio.sleep(0.005)
+
+
+async def stop_playback(ctx):
+    await main.stop(ctx)
+    main.idle_scheduler.cancel(ctx.guild.id)
+
+
+async def time_to_first_audio(runs):
+    """Seconds from !play <search> until the voice client starts playing"""
+    times = []
+    for i in range(runs):
+        ctx = new_ctx()
+        start = time.monotonic()
+        await main.play(ctx, query=f"first audio song {i} {time.time()}")
+        times.append(ctx.voice_client.started[0] - start)
+        await stop_playback(ctx)
+    return {'runs': runs, 'median_s': statistics.median(times), 'max_s': max(times)}
+
+
+async def youtube_playlist(size):
+    """Enqueue throughput and time to first audio for a YouTube playlist of `size` tracks"""
+    ctx = new_ctx()
+    guild_player = main.get_player(ctx.guild.id)
+    guild_player.queue = CountingQueue()
+    start = time.monotonic()
+    await main.play(ctx, query=f"https://www.youtube.com/playlist?list=N{size}")
+    first_audio = ctx.voice_client.started[0] - start
+    await until(lambda: not guild_player.fills)
+    elapsed = time.monotonic() - start
+    queued = guild_player.queue.added
+    await stop_playback(ctx)
+    return {'tracks': queued, 'enqueue_s': elapsed, 'tracks_per_s': queued / elapsed, 'first_audio_s': first_audio}
+
+
+async def spotify_playlist(size):
+    """Same for a Spotify playlist, where every track is matched with a YouTube search"""
+    ctx = new_ctx()
+    guild_player = main.get_player(ctx.guild.id)
+    guild_player.queue = CountingQueue()
+    main.search_cache.clear()  # Every run pays for its searches
+    start = time.monotonic()
+    await main.play(ctx, query=f"https://open.spotify.com/playlist/N{size}")
+    first_audio = ctx.voice_client.started[0] - start
+    await until(lambda: not guild_player.fills)
+    elapsed = time.monotonic() - start
+    queued = guild_player.queue.added
+    await stop_playback(ctx)
+    return {'tracks': queued, 'enqueue_s': elapsed, 'tracks_per_s': queued / elapsed, 'first_audio_s': first_audio}
+
+
+async def inter_track_gap(tracks):
+    """Gap between one track ending and the next starting, with the prefetcher running"""
+    ctx = new_ctx()
+    guild_player = main.get_player(ctx.guild.id)
+    await main.play(ctx, query=f"https://www.youtube.com/playlist?list=N{tracks}")
+    await until(lambda: len(ctx.voice_client.started) >= tracks)
+    await stop_playback(ctx)
+    gaps = list(guild_player.gaps)
+    return {'transitions': len(gaps), 'median_ms': statistics.median(gaps) * 1000, 'max_ms': max(gaps) * 1000}
+
+
+def memory_per_track(count):
+    """Bytes held per queued (not yet resolved) playlist track"""
+    fakes.Latency.playlist_page, page = 0, fakes.Latency.playlist_page
+    try:
+        entries = list(fakes.FakeYoutubeDL()._entries(count))
+    finally:
+        fakes.Latency.playlist_page = page
+    guild_player = main.get_player(next(_guild_ids))
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    guild_player.queue.extend(main.Track.from_flat_entry(entry) for entry in entries)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    guild_player.queue.clear()
+    return {'tracks': count, 'bytes_per_track': size / count}
+
+
+async def queue_commands(size, runs):
+    """Operations per second for the queue commands on a `size`-track queue"""
+    ctx = new_ctx()
+    guild_player = main.get_player(ctx.guild.id)
+    await main.play(ctx, query=f"https://www.youtube.com/playlist?list=N{size}")
+    await until(lambda: not guild_player.fills)
+    results = {'queue_length': len(guild_player.queue)}
+    commands = {
+        'queue': lambda: main.queue(ctx),
+        'queue_chat': lambda: chat_queue(ctx),
+        'queue_page_flip': lambda: flip_page(guild_player),
+        'nowplaying': lambda: main.nowplaying(ctx),
+        'shuffle': lambda: main.shuffle(ctx),
+        'loop': lambda: main.loop_command(ctx, 'queue'),
+        'remove_and_requeue': lambda: remove_and_requeue(ctx, guild_player),
+        'move': lambda: main.move(ctx, 2, len(guild_player.queue) - 1),
+    }
+    for name, command in commands.items():
+        start = time.perf_counter()
+        for _ in range(runs):
+            await command()
+        results[f"{name}_per_s"] = runs / (time.perf_counter() - start)
+    await stop_playback(ctx)
+    return results
+
+
+async def chat_queue(ctx):
+    # "@Miku queue" reaches the same command through PseudoCtx, whose send() must take the page buttons too
+    await main.on_message(fakes.FakeMessage(main.bot.user, ctx, "queue"))
+    if ctx.channel.last.view is None:
+        raise RuntimeError(f"chat queue sent no pages: {ctx.channel.last.content}")
+
+
+async def flip_page(guild_player):
+    # What a button click on the !queue message costs: a (cached) page render
+    main.render_page(guild_player, 5)
+
+
+async def remove_and_requeue(ctx, guild_player):
+    track = guild_player.queue[len(guild_player.queue) // 2]
+    await main.remove(ctx, len(guild_player.queue) // 2 + 1)
+    guild_player.queue.append(track)
+
+
+def _deque_move(q, source, destination):
+    track = q[source]
+    del q[source]
+    q.insert(destination, track)
+
+
+def _deque_shuffle(q):
+    tracks = list(q)
+    random.shuffle(tracks)
+    q.clear()
+    q.extend(tracks)
+
+
+QUEUE_OPERATIONS = {
+    # name: (deque version, TrackQueue version); i and j are random positions
+    'get': (lambda q, i, j: q[i], lambda q, i, j: q[i]),
+    'remove_and_append': (lambda q, i, j: (q.append(q[i]), q.__delitem__(i)), lambda q, i, j: q.append(q.pop(i))),
+    'move': (_deque_move, lambda q, i, j: q.move(i, j)),
+    'insert_next': (lambda q, i, j: (q.insert(0, q[i]), q.popleft()), lambda q, i, j: (q.insert(0, q[i]), q.popleft())),
+    'page_of_10': (lambda q, i, j: list(islice(q, i, i + 10)), lambda q, i, j: q.slice(i, i + 10)),
+    'shuffle': (lambda q, i, j: _deque_shuffle(q), lambda q, i, j: q.shuffle()),
+}
+
+
+def queue_structure(size, runs):
+    """Operations per second on a `size`-track queue, deque vs TrackQueue (plus the old random.shuffle(deque))"""
+    tracks = [main.Track(f"song {i}") for i in range(size)]
+    rng = random.Random(0)
+    positions = [(rng.randrange(size - 1), rng.randrange(size - 1)) for _ in range(runs)]
+    results = {'queue_length': size}
+    for name, implementations in QUEUE_OPERATIONS.items():
+        count = runs if name != 'shuffle' else max(1, runs // 100)
+        for kind, operation in zip(('deque', 'track_queue'), implementations):
+            q = deque(tracks) if kind == 'deque' else TrackQueue(tracks)
+            start = time.perf_counter()
+            for i, j in positions[:count]:
+                operation(q, i, j)
+            results[f"{name}_per_s"] = results.get(f"{name}_per_s", {})
+            results[f"{name}_per_s"][kind] = count / (time.perf_counter() - start)
+    q = deque(tracks)
+    start = time.perf_counter()
+    random.shuffle(q)  # What !shuffle used to do: O(n^2) because deque indexing is O(n)
+    results['shuffle_per_s']['deque_in_place'] = 1 / (time.perf_counter() - start)
+    return results
+
+
+def member_lookup(size, runs):
+    """Microseconds to find who "timeout <name> ..." means in a `size`-member guild: scanning vs MemberIndex"""
+    rng = random.Random(0)
+    words = ['dark', 'neo', 'shadow', 'kawaii', 'miku', 'fan', 'gamer', 'pro', 'lil', 'cool', 'cat', 'ninja', 'star']
+    members = [fakes.FakeMember(i, f"{rng.choice(words)}{rng.choice(words)}{i}") for i in range(size)]
+    target_text = f"{members[-1].name} is so annoying"  # Last member: the scan's worst case
+
+    def scan():
+        # What chat_timeout did before the index
+        for member in members:
+            if member.display_name.lower() in target_text.lower() or member.name.lower() in target_text.lower():
+                return member
+
+    start = time.perf_counter()
+    index = MemberIndex(members)
+    build = time.perf_counter() - start
+    results = {'members': size, 'index_build_ms': build * 1000}
+    for name, lookup, count in (('scan', scan, max(1, runs // 500)), ('index', lambda: index.find(target_text), runs)):
+        start = time.perf_counter()
+        for _ in range(count):
+            lookup()
+        results[f"{name}_us"] = (time.perf_counter() - start) / count * 1e6
+    return results
+
+
+async def chat_dispatch(count):
+    """Messages per second through on_message: routing alone, and end to end with real handlers and fake Gemini"""
+    ctx = new_ctx()
+    bot_user = main.bot.user
+    guild_player = main.get_player(ctx.guild.id)
+    await main.play(ctx, query="https://www.youtube.com/playlist?list=N20")
+    await until(lambda: not guild_player.fills)
+    messages = [fakes.FakeMessage(bot_user, ctx, CHAT_SAMPLES[i % len(CHAT_SAMPLES)]) for i in range(count)]
+
+    handlers = [route.handler for route in main.chat_router.routes]
+    respond_with_ai = main.respond_with_ai
+
+    async def noop(*args, **kwargs):
+        pass
+
+    for route in main.chat_router.routes:
+        route.handler = noop
+    main.respond_with_ai = noop
+    try:
+        start = time.perf_counter()
+        for message in messages:
+            await main.on_message(message)
+        routing = count / (time.perf_counter() - start)
+    finally:
+        for route, handler in zip(main.chat_router.routes, handlers):
+            route.handler = handler
+        main.respond_with_ai = respond_with_ai
+
+    gemini, fakes.Latency.gemini = fakes.Latency.gemini, 0
+    try:
+        start = time.perf_counter()
+        for message in messages:
+            await main.on_message(message)
+            if len(guild_player.queue) < 5:
+                guild_player.queue.extend(main.Track(f"filler {i}") for i in range(10))
+        end_to_end = count / (time.perf_counter() - start)
+    finally:
+        fakes.Latency.gemini = gemini
+    await stop_playback(ctx)
+    return {'messages': count, 'routing_per_s': routing, 'end_to_end_per_s': end_to_end}
+
+
+async def ai_first_text(runs):
+    """Seconds until the first reply text is visible, streamed vs waiting for the full reply"""
+    results = {}
+    for streaming in (False, True):
+        main.AI_STREAMING = streaming
+        times = []
+        for i in range(runs):
+            ctx = new_ctx()
+            message = fakes.FakeMessage(main.bot.user, ctx, f"tell me something nice {i}")
+            first = []
+            send = ctx.channel.send
+
+            async def record(content=None, *, embed=None, send=send, first=first):
+                first.append(time.monotonic())
+                return await send(content, embed=embed)
+
+            ctx.channel.send = record
+            start = time.monotonic()
+            await main.respond_with_ai(message, [message.content])
+            times.append(first[0] - start)
+        results['streaming' if streaming else 'full'] = {'median_s': statistics.median(times)}
+    main.AI_STREAMING = os.getenv('AI_STREAMING', '1') != '0'
+    return results
+
+
+async def run(args):
+    fakes.Latency.extract = args.extract_latency
+    fakes.Latency.playlist_page = args.page_latency
+    fakes.Latency.spotify = args.spotify_latency
+    fakes.Latency.gemini = args.gemini_latency
+    fakes.Latency.track = args.track_seconds
+    fakes.install(main)
+
+    results = {
+        'time_to_first_audio': await time_to_first_audio(args.runs),
+        'youtube_playlist': {str(size): await youtube_playlist(size) for size in PLAYLIST_SIZES},
+        'spotify_playlist': {str(size): await spotify_playlist(size) for size in PLAYLIST_SIZES},
+        'inter_track_gap': await inter_track_gap(args.gap_tracks),
+        'memory_per_queued_track': memory_per_track(10_000),
+        'queue_commands': await queue_commands(1000, args.runs * 20),
+        'queue_structure': {str(size): queue_structure(size, args.runs * 400) for size in QUEUE_SIZES},
+        'chat_dispatch': await chat_dispatch(args.messages),
+        'member_lookup': {str(size): member_lookup(size, args.runs * 2000) for size in GUILD_SIZES},
+        'ai_first_text': await ai_first_text(args.runs),
+    }
+    return {
+        'python': platform.python_version(),
+        'latency_s': {'extract': args.extract_latency, 'playlist_page': args.page_latency,
+                      'spotify': args.spotify_latency, 'gemini': args.gemini_latency, 'track': args.track_seconds},
+        'results': results,
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', help="Also write the JSON here")
+    parser.add_argument('--extract-latency', type=float, default=fakes.Latency.extract)
+    parser.add_argument('--page-latency', type=float, default=fakes.Latency.playlist_page)
+    parser.add_argument('--spotify-latency', type=float, default=fakes.Latency.spotify)
+    parser.add_argument('--gemini-latency', type=float, default=fakes.Latency.gemini)
+    parser.add_argument('--track-seconds', type=float, default=fakes.Latency.track)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--gap-tracks', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    # The bot prints progress/errors to stdout; keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + "\n")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,49 @@
+import re
+
+_tokens = re.compile(r"[a-z0-9']+")
+
+
+class ChatRoute:
+    __slots__ = ('name', 'handler', 'words', 'pattern', 'requires')
+
+    def __init__(self, name, handler, words, pattern, requires):
+        self.name = name
+        self.handler = handler
+        self.words = words
+        self.pattern = pattern
+        self.requires = requires
+
+
+class ChatRouter:
+    """Picks at most one chat command for a mention, trying routes in the order they were added.
+
+    The message is lowercased and tokenized once. A route matches when one of
+    its trigger words is a whole token (so "q" only means queue when it's a word
+    on its own), every `requires` group has a token present, and its precompiled
+    pattern (if any) matches. The first matching route wins.
+    """
+
+    def __init__(self):
+        self.routes = []
+
+    def add(self, name, handler, *, words, pattern=None, requires=()):
+        """handler(ctx, match) -> coroutine; match is the pattern's re.Match (or None)"""
+        self.routes.append(ChatRoute(name, handler, frozenset(words),
+                                     re.compile(pattern) if pattern else None,
+                                     tuple(frozenset(group) for group in requires)))
+
+    def match(self, content):
+        """Return (route, re.Match or None) for the first route that matches, else None"""
+        lowered = content.lower()
+        tokens = set(_tokens.findall(lowered))
+        for route in self.routes:
+            if tokens.isdisjoint(route.words):
+                continue
+            if any(tokens.isdisjoint(group) for group in route.requires):
+                continue
+            if route.pattern is None:
+                return route, None
+            found = route.pattern.search(lowered)
+            if found:
+                return route, found
+        return None
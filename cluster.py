@@ -0,0 +1,279 @@
+"""Runs the bot as several processes ("clusters"), each an AutoShardedBot for a slice of the shards.
+
+Every cluster is a separate main.py with its own event loop, GIL and
+extraction pool. The search cache, stream cache and queue snapshots live in
+one state directory shared by all of them. The launcher restarts clusters that
+exit or stop answering /health, and serves the aggregated view on the usual
+keep-alive port: / for uptime pings, /health with every cluster's status and
+totals, /metrics with each cluster's metrics labelled cluster="<id>".
+
+    python cluster.py --clusters 4 [--shards 16] [--state-dir cluster_state] [--fake-gateway]
+
+--fake-gateway runs benchmarks/fake_gateway.py in place of main.py: no
+Discord connection, fake guilds on each shard playing through the benchmark
+fakes. Use it to try the launcher, restarts and aggregation locally.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from keep_alive import keep_alive
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+POLL_INTERVAL = 5  # Seconds between /health polls
+STARTUP_GRACE = 180  # Seconds a new cluster gets to log in before an unanswered /health counts against it
+HANG_TIMEOUT = 60  # Restart a started cluster whose /health hasn't answered for this long
+MAX_BACKOFF = 60
+
+
+def shard_ranges(shards, clusters):
+    """Split shard IDs 0..shards-1 into `clusters` contiguous, near-equal ranges"""
+    size, extra = divmod(shards, clusters)
+    ranges, start = [], 0
+    for i in range(clusters):
+        end = start + size + (i < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def recommended_shards(token):
+    """Discord's recommended shard count for this bot (GET /gateway/bot)"""
+    request = urllib.request.Request('https://discord.com/api/v10/gateway/bot',
+                                     headers={'Authorization': f'Bot {token}', 'User-Agent': 'fufu-bot cluster'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)['shards']
+
+
+def fetch(url, timeout=2):
+    """GET a cluster's local endpoint; returns (status, body text), /health answers 503 while not ready"""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+class Cluster:
+    def __init__(self, cluster_id, shards, shard_count, port, script, env):
+        self.id = cluster_id
+        self.shards = shards
+        self.shard_count = shard_count
+        self.port = port
+        self.script = script
+        self.env = env
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.failures = 0  # Consecutive failed starts, for the restart backoff
+        self.restart_at = 0.0
+        self.health = None  # Last /health report
+        self.last_seen = 0.0  # When /health last answered
+        self.last_error = None
+
+    def start(self):
+        env = {**os.environ, **self.env,
+               'CLUSTER_ID': str(self.id),
+               'SHARD_COUNT': str(self.shard_count),
+               'SHARD_IDS': ','.join(map(str, self.shards)),
+               'KEEP_ALIVE_HOST': '127.0.0.1',
+               'KEEP_ALIVE_PORT': str(self.port)}
+        self.process = subprocess.Popen([sys.executable, self.script], cwd=HERE, env=env)
+        self.started = time.monotonic()
+        self.health = None
+        print(f"Cluster {self.id}: started (pid {self.process.pid}, shards {self.shards[0]}-{self.shards[-1]})")
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def ready(self):
+        return self.running and bool(self.health and self.health.get('ready'))
+
+    def poll(self):
+        try:
+            _, body = fetch(f'http://127.0.0.1:{self.port}/health')
+            self.health = json.loads(body)
+            self.last_seen = time.monotonic()
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+
+    def supervise(self, now):
+        if self.process is None:
+            return
+        if not self.running:
+            if self.restart_at == 0:
+                self.last_error = f"exited with code {self.process.returncode}"
+                # A cluster that ran a while before dying restarts right away; one that keeps dying backs off
+                self.failures = 0 if now - self.started > 10 * 60 else self.failures + 1
+                self.restart_at = now + min(MAX_BACKOFF, 2 ** self.failures - 1)
+                print(f"Cluster {self.id}: {self.last_error}, restarting in {self.restart_at - now:.0f}s")
+            if now >= self.restart_at:
+                self.restart_at = 0
+                self.restarts += 1
+                self.start()
+            return
+        self.poll()
+        seen = max(self.last_seen, self.started + STARTUP_GRACE - HANG_TIMEOUT)
+        if now - seen > HANG_TIMEOUT:
+            self.last_error = f"/health unanswered for {now - seen:.0f}s"
+            print(f"Cluster {self.id}: {self.last_error}, killing it")
+            self.process.kill()
+
+    def status(self, now):
+        return {
+            'cluster': self.id,
+            'pid': self.process.pid if self.process else None,
+            'running': self.running,
+            'ready': self.ready,
+            'shards': self.shards,
+            'uptime': now - self.started if self.running else 0,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'health': self.health,
+        }
+
+
+class Supervisor:
+    def __init__(self, clusters):
+        self.clusters = clusters
+        self.stopping = False
+
+    def start(self):
+        for cluster in self.clusters:
+            cluster.start()
+        threading.Thread(target=self._run, name='cluster-supervisor', daemon=True).start()
+
+    def _run(self):
+        while not self.stopping:
+            time.sleep(POLL_INTERVAL)
+            for cluster in self.clusters:
+                if not self.stopping:
+                    cluster.supervise(time.monotonic())
+
+    def health(self):
+        """Aggregated /health: every cluster's status plus totals; ready only if all clusters are"""
+        now = time.monotonic()
+        clusters = [cluster.status(now) for cluster in self.clusters]
+        reports = [cluster['health'] for cluster in clusters if cluster['running'] and cluster['health']]
+        totals = {key: sum(report.get(key) or 0 for report in reports)
+                  for key in ('guilds', 'voice_connections', 'playing', 'queued', 'extractions')}
+        totals['clusters_ready'] = sum(cluster['ready'] for cluster in clusters)
+        return {'ready': all(cluster['ready'] for cluster in clusters), 'totals': totals, 'clusters': clusters}
+
+    def metrics_page(self):
+        """Every running cluster's /metrics, merged, plus the launcher's own per-cluster gauges"""
+        now = time.monotonic()
+        pages = []
+        for cluster in self.clusters:
+            if cluster.running:
+                try:
+                    status, body = fetch(f'http://127.0.0.1:{cluster.port}/metrics', timeout=5)
+                    if status == 200:
+                        pages.append((cluster.id, body))
+                except OSError:
+                    pass  # Shows up as miku_cluster_up 0 / a stale /health below
+        own = ["# HELP miku_cluster_up Whether the cluster's process is running and ready",
+               "# TYPE miku_cluster_up gauge"]
+        own += [f'miku_cluster_up{{cluster="{c.id}"}} {int(c.ready)}' for c in self.clusters]
+        own += ["# HELP miku_cluster_restarts_total Times the launcher restarted the cluster",
+                "# TYPE miku_cluster_restarts_total counter"]
+        own += [f'miku_cluster_restarts_total{{cluster="{c.id}"}} {c.restarts}' for c in self.clusters]
+        own += ["# HELP miku_cluster_uptime_seconds Seconds since the cluster's process started",
+                "# TYPE miku_cluster_uptime_seconds gauge"]
+        own += [f'miku_cluster_uptime_seconds{{cluster="{c.id}"}} {now - c.started if c.running else 0}'
+                for c in self.clusters]
+        return merge_metrics(pages) + "\n".join(own) + "\n"
+
+    def stop(self, timeout=30):
+        """SIGTERM every cluster (each snapshots its queues on the way out), then kill stragglers"""
+        self.stopping = True
+        for cluster in self.clusters:
+            if cluster.running:
+                cluster.process.terminate()
+        deadline = time.monotonic() + timeout
+        for cluster in self.clusters:
+            if cluster.process is None:
+                continue
+            try:
+                cluster.process.wait(max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                cluster.process.kill()
+
+
+def merge_metrics(pages):
+    """Merge (cluster_id, exposition text) pages into one, adding cluster="<id>" to every sample.
+
+    Prometheus wants each metric family's HELP/TYPE once and its samples
+    together, so samples are grouped by family across all pages.
+    """
+    families = {}  # name -> [HELP/TYPE lines, samples]
+    for cluster_id, page in pages:
+        family = None
+        for line in page.splitlines():
+            if line.startswith(('# HELP ', '# TYPE ')):
+                family = line.split(' ', 3)[2]
+                header = families.setdefault(family, ([], []))[0]
+                if len(header) < 2 and line not in header:
+                    header.append(line)
+                continue
+            if not line or line.startswith('#'):
+                continue
+            brace, space = line.find('{'), line.find(' ')
+            if brace != -1 and brace < space:
+                sample = f'{line[:brace + 1]}cluster="{cluster_id}",{line[brace + 1:]}'
+            else:
+                sample = f'{line[:space]}{{cluster="{cluster_id}"}}{line[space:]}'
+            families.setdefault(family or line[:space], ([], []))[1].append(sample)
+    lines = []
+    for header, samples in families.values():
+        lines += header + samples
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clusters', type=int, default=int(os.getenv('CLUSTERS', '2')))
+    parser.add_argument('--shards', type=int, help="Total shards (default: Discord's recommendation, at least one per cluster)")
+    parser.add_argument('--state-dir', default=os.getenv('CLUSTER_STATE_DIR', 'cluster_state'),
+                        help="Shared search cache, stream cache and queue snapshots")
+    parser.add_argument('--port', type=int, default=int(os.getenv('KEEP_ALIVE_PORT', '8080')),
+                        help="Aggregated keep-alive server; cluster i listens on 127.0.0.1:port+1+i")
+    parser.add_argument('--fake-gateway', action='store_true', help="Run benchmarks/fake_gateway.py instead of main.py")
+    args = parser.parse_args()
+
+    if args.shards is None:
+        args.shards = args.clusters * 2 if args.fake_gateway else recommended_shards(os.environ['DISCORD_TOKEN'])
+    shards = max(args.shards, args.clusters)
+    os.makedirs(args.state_dir, exist_ok=True)
+    state_dir = os.path.abspath(args.state_dir)
+    env = {
+        'SEARCH_CACHE_PATH': os.path.join(state_dir, 'search_cache.db'),
+        'STREAM_CACHE_PATH': os.path.join(state_dir, 'streams.db'),
+        'QUEUE_DB': os.path.join(state_dir, 'queues.db'),
+    }
+    script = os.path.join(HERE, 'benchmarks', 'fake_gateway.py') if args.fake_gateway else os.path.join(HERE, 'main.py')
+    supervisor = Supervisor([Cluster(i, shard_ids, shards, args.port + 1 + i, script, env)
+                             for i, shard_ids in enumerate(shard_ranges(shards, args.clusters))])
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    keep_alive(port=args.port, health=supervisor.health, metrics_page=supervisor.metrics_page)
+    supervisor.start()
+    stop.wait()
+    print("Stopping clusters...")
+    supervisor.stop()
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,195 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlite_writer import READ_TIMEOUT, SQLiteWriter, connect, shared_path
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count (~4 characters per token), good enough for budgeting"""
+    return len(text) // 4 + 1
+
+
+class _History:
+    __slots__ = ('turns', 'tokens', 'summary', 'last_used')
+
+    def __init__(self, turns=(), summary=''):
+        self.turns = deque(tuple(turn) for turn in turns)  # (role, text), role is 'user' or 'model'
+        self.tokens = sum(estimate_tokens(text) for _, text in self.turns)
+        self.summary = summary  # Short recap of the turns that no longer fit
+        self.last_used = time.monotonic()
+
+
+class ConversationStore:
+    """Recent chat turns per (guild, channel, user), bounded in count, age and size.
+
+    At most `max_conversations` histories stay in memory (least recently used
+    go first), histories idle for `ttl` seconds are dropped, and each history
+    keeps only its newest turns within `max_turns` and `max_tokens`. Turns that
+    fall out are handed back by append() so the caller can fold them into the
+    history's running summary. With a `path`, dropped histories are written to
+    SQLite instead of discarded and are read back the next time that user
+    talks in that channel. As in SearchCache, writes go through a writer thread
+    and a read that can't get the file quickly (another cluster process holds
+    the lock) counts as a miss, so the event loop never waits on SQLite.
+    """
+
+    def __init__(self, path=None, *, max_conversations=5000, ttl=3600, max_turns=20, max_tokens=300,
+                 disk_ttl=7 * 24 * 3600):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.disk_ttl = disk_ttl
+        self.tokens = 0  # Estimated tokens held in memory across all histories
+        self._histories = OrderedDict()  # key -> _History, least recently used first
+        self._db = None
+        self._writer = None
+        self._unwritten = {}  # db key -> _History dropped but still queued for the writer
+        self._lock = threading.Lock()  # Guards _unwritten against the writer thread
+        if path:
+            path = shared_path(path, f'conversations_{id(self)}')
+            self._db = connect(path)
+            self._db.execute('''CREATE TABLE IF NOT EXISTS conversations (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                last_used REAL NOT NULL)''')
+            self._db.execute(f'PRAGMA busy_timeout = {int(READ_TIMEOUT * 1000)}')
+            self._writer = SQLiteWriter(path, name='conversations')
+            self._writer.execute('DELETE FROM conversations WHERE last_used < ?', (time.time() - disk_ttl,))
+
+    @staticmethod
+    def key(message):
+        return (message.guild.id if message.guild else 0, message.channel.id, message.author.id)
+
+    def __len__(self):
+        return len(self._histories)
+
+    def on_disk(self):
+        """Histories written to (or queued for) the file, None if it is locked right now"""
+        if self._db is None:
+            return 0
+        try:
+            count = self._db.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Conversation store read error: {e}")
+            return None
+        with self._lock:
+            return count + len(self._unwritten)  # Close enough: a queued key may already have a row
+
+    def get(self, key):
+        """(summary, [(role, text), ...]) for a conversation, turns oldest first"""
+        self.expire()
+        history = self._histories.get(key)
+        if history is None:
+            history = self._load(key)
+            if history is None:
+                return '', []
+        self._touch(key, history)
+        return history.summary, list(history.turns)
+
+    def append(self, key, *turns):
+        """Add (role, text) turns; returns the oldest turns trimmed off to stay within budget"""
+        self.expire()
+        history = self._histories.get(key)
+        if history is None:
+            history = self._load(key) or _History()
+        else:
+            self.tokens -= history.tokens  # _touch() adds the new size back
+            del self._histories[key]
+        for turn in turns:
+            history.turns.append(turn)
+            history.tokens += estimate_tokens(turn[1])
+        trimmed = []
+        # Oldest turns go first, whole exchanges at a time so history still starts with a user turn.
+        # The newest exchange stays even if it alone is over budget.
+        while len(history.turns) > 2 and (len(history.turns) > self.max_turns or history.tokens > self.max_tokens):
+            trimmed.append(history.turns.popleft())
+            history.tokens -= estimate_tokens(trimmed[-1][1])
+            while history.turns and history.turns[0][0] != 'user':
+                trimmed.append(history.turns.popleft())
+                history.tokens -= estimate_tokens(trimmed[-1][1])
+        self._touch(key, history)
+        while len(self._histories) > self.max_conversations:
+            self._drop(*self._histories.popitem(last=False))
+        return trimmed
+
+    def set_summary(self, key, summary):
+        history = self._histories.get(key)
+        if history is None:
+            history = self._load(key) or _History()
+        history.summary = summary
+        self._touch(key, history)
+
+    def expire(self):
+        """Drop histories nobody has used for `ttl` seconds (they're in LRU order, so stop at the first live one)"""
+        cutoff = time.monotonic() - self.ttl
+        while self._histories:
+            key, history = next(iter(self._histories.items()))
+            if history.last_used > cutoff:
+                break
+            del self._histories[key]
+            self._drop(key, history)
+
+    def close(self):
+        """Write every in-memory history to disk (no-op without a path)"""
+        while self._histories:
+            self._drop(*self._histories.popitem(last=False))
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _touch(self, key, history):
+        if key not in self._histories:
+            self._histories[key] = history
+            self.tokens += history.tokens
+        history.last_used = time.monotonic()
+        self._histories.move_to_end(key)
+
+    def _drop(self, key, history):
+        self.tokens -= history.tokens
+        if self._writer is None or not (history.turns or history.summary):
+            return
+        db_key = self._db_key(key)
+        row = (db_key, json.dumps({'summary': history.summary, 'turns': list(history.turns)}), time.time())
+
+        def write(db):
+            db.execute('INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)', row)
+            with self._lock:
+                if self._unwritten.get(db_key) is history:  # Not already read back, or dropped again since
+                    del self._unwritten[db_key]
+
+        with self._lock:
+            self._unwritten[db_key] = history  # Until the row lands, _load() finds it here
+        self._writer.call(write)
+
+    def _load(self, key):
+        if self._db is None:
+            return None
+        db_key = self._db_key(key)
+        with self._lock:
+            history = self._unwritten.pop(db_key, None)
+        if history is not None:
+            self._writer.execute('DELETE FROM conversations WHERE key = ?', (db_key,))  # Runs after its INSERT
+            return history
+        try:
+            row = self._db.execute('SELECT data, last_used FROM conversations WHERE key = ?', (db_key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Conversation store read error: {e}")
+            return None  # Locked by another process: start afresh instead of waiting
+        if row is None:
+            return None
+        self._writer.execute('DELETE FROM conversations WHERE key = ?', (db_key,))
+        if time.time() - row[1] > self.disk_ttl:
+            return None
+        data = json.loads(row[0])
+        return _History(data['turns'], data['summary'])
+
+    @staticmethod
+    def _db_key(key):
+        return ':'.join(map(str, key))
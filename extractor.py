@@ -0,0 +1,99 @@
+import asyncio
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import yt_dlp
+
+# Request priorities (lower runs first)
+INTERACTIVE = 0  # Someone is waiting on it: !play, the next song in play_next
+PREFETCH = 1  # Upcoming queue entries
+BACKGROUND = 2  # Playlist/Spotify fills
+
+_worker = threading.local()
+_profiles = {}
+
+
+def _init_worker(profiles):
+    global _profiles
+    _profiles = profiles
+
+
+def _ydl(profile):
+    """This worker's own YoutubeDL for a profile (YoutubeDL isn't safe to share between threads)"""
+    instances = getattr(_worker, 'instances', None)
+    if instances is None:
+        instances = _worker.instances = {}
+    if profile not in instances:
+        instances[profile] = yt_dlp.YoutubeDL(_profiles[profile])
+    return instances[profile]
+
+
+def _extract(profile, url, sanitize):
+    ydl = _ydl(profile)
+    info = ydl.extract_info(url, download=False)
+    # Results cross a process boundary in process mode, so strip anything unpicklable
+    return ydl.sanitize_info(info) if sanitize and info else info
+
+
+def _walk(profile, fn):
+    return fn(_ydl(profile))
+
+
+class ExtractionService:
+    """yt-dlp extraction on its own worker pool, fed from a priority queue"""
+
+    def __init__(self, profiles, *, workers=4, use_processes=False, walkers=3):
+        self.profiles = profiles
+        self.workers = workers
+        self.use_processes = use_processes
+        self.in_flight = 0
+        self.completed = 0
+        self._seq = itertools.count()  # FIFO tie-break within a priority
+        self._queue = None
+        self._dispatchers = []
+        _init_worker(profiles)
+        if use_processes:
+            self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(profiles,))
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ytdl')
+        # Playlist walks iterate lazy yt-dlp generators, so they always run on threads
+        self._walk_pool = ThreadPoolExecutor(max_workers=walkers, thread_name_prefix='ytdl-walk')
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, future, profile, url = await self._queue.get()
+            if future.done():
+                continue  # Cancelled (or timed out) while it was still queued
+            self.in_flight += 1
+            try:
+                result = await loop.run_in_executor(self._pool, _extract, profile, url, self.use_processes)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def queued(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def extract(self, url, *, profile='default', priority=INTERACTIVE):
+        """Queue an extract_info call; cancelling the awaiting task drops it if it hasn't started yet"""
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((priority, next(self._seq), future, profile, url))
+        return await future
+
+    def walk(self, fn, *, profile='flat'):
+        """Run fn(ydl) on a walk thread, for iterating lazy playlist listings"""
+        return asyncio.get_running_loop().run_in_executor(self._walk_pool, _walk, profile, fn)
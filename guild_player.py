@@ -0,0 +1,63 @@
+import asyncio
+import contextlib
+from collections import deque
+
+from track_queue import TrackQueue
+
+
+class GuildPlayer:
+    """All playback state for one guild; commands touching it hold `lock` so they run one at a time"""
+
+    __slots__ = ('guild_id', 'queue', 'current', 'loop_mode', 'volume', 'text_channel_id', 'resume_at',
+                 'prefetching', 'fills', 'ended_at', 'gaps', 'lock', 'version', 'pages')
+
+    def __init__(self, guild_id, *, volume=1.0):
+        self.guild_id = guild_id
+        self.queue = TrackQueue()  # Upcoming Tracks
+        self.current = None  # Audio source that is playing (None when idle)
+        self.loop_mode = 'off'  # 'off', 'track', 'queue'
+        self.volume = volume  # 0.0-1.0, applied to every new track
+        self.text_channel_id = None  # Where the last !play came from (announcements after a restore go there)
+        self.resume_at = 0  # Seconds into the next track to start at (set when restoring a snapshot)
+        self.prefetching = []  # Tracks with a background resolve in flight
+        self.fills = set()  # Background playlist/Spotify fills still adding tracks
+        self.ended_at = None  # When the last track finished (for gap measurement)
+        self.gaps = deque(maxlen=20)  # Recent inter-track gaps in seconds
+        self.lock = asyncio.Lock()
+        self.version = 0  # Bumped by changed() whenever the queue, current track, loop mode or volume change
+        self.pages = None  # queue_view.PageCache: rendered !queue pages for the current version
+
+    def status(self):
+        """Get current music playback status"""
+        return {
+            'is_playing': self.current is not None,
+            'current_song': self.current.title if self.current is not None else None,
+            'queue_length': len(self.queue),
+            'loop_mode': self.loop_mode,
+            'last_gap': self.gaps[-1] if self.gaps else None,
+        }
+
+    def changed(self):
+        self.version += 1
+
+    def cancel_fills(self):
+        for task in self.fills:
+            task.cancel()
+        self.fills.clear()
+
+    @contextlib.asynccontextmanager
+    async def unlocked(self):
+        """Inside a command holding `lock`: let other commands (and play_next) run during a long wait, then retake it"""
+        self.lock.release()
+        try:
+            yield
+        finally:
+            cancelled = False
+            while True:
+                try:
+                    await self.lock.acquire()
+                    break
+                except asyncio.CancelledError:
+                    cancelled = True  # The command's `async with lock` releases it on the way out, so hold it first
+            if cancelled:
+                raise asyncio.CancelledError
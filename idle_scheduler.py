@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class IdleScheduler:
+    """Idle-disconnect deadlines for every guild, run by a single task off a heap.
+
+    arm() (re)sets a guild's deadline and cancel() drops it. Replaced or
+    cancelled deadlines stay in the heap and are skipped when they reach the
+    top, so both are O(log n) at most. When a deadline passes,
+    on_idle(key, payload) runs as its own task so a slow disconnect doesn't
+    hold up the guilds behind it.
+    """
+
+    def __init__(self, timeout, on_idle):
+        self.timeout = timeout
+        self.on_idle = on_idle
+        self.fired = 0
+        self._deadlines = {}  # key -> (deadline, payload)
+        self._heap = []  # (deadline, seq, key), may hold stale entries
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._firing = set()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def arm(self, key, payload=None):
+        """Fire on_idle(key, payload) after `timeout` seconds unless re-armed or cancelled first"""
+        self._start()
+        deadline = time.monotonic() + self.timeout
+        self._deadlines[key] = (deadline, payload)
+        heapq.heappush(self._heap, (deadline, next(self._seq), key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            # Mostly stale entries from re-arming; rebuild from the live deadlines
+            self._heap = [(deadline, next(self._seq), key) for key, (deadline, _) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def _live(self, entry):
+        deadline, _, key = entry
+        current = self._deadlines.get(key)
+        return current is not None and current[0] == deadline
+
+    async def _run(self):
+        while True:
+            while self._heap and not self._live(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, key = heapq.heappop(self._heap)
+            _, payload = self._deadlines.pop(key)
+            self.fired += 1
+            task = asyncio.create_task(self._fire(key, payload))
+            self._firing.add(task)
+            task.add_done_callback(self._firing.discard)
+
+    async def _fire(self, key, payload):
+        try:
+            await self.on_idle(key, payload)
+        except Exception as e:
+            print(f"Idle disconnect error: {e}")
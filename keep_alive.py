@@ -1,7 +1,15 @@
-from flask import Flask
+import logging
+import math
+from flask import Flask, Response, jsonify
 from threading import Thread
 
+import metrics
+
 app = Flask('')
+logging.getLogger('werkzeug').setLevel(logging.WARNING)  # No line per request (cluster.py polls /health)
+
+_health = None  # () -> dict for /health; 'ready': False makes it a 503
+_metrics_page = metrics.render
 
 
 @app.route('/')
@@ -9,10 +17,37 @@ def home():
     return "I'm alive!"
 
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(_metrics_page(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health')
+def health():
+    report = _health() if _health is not None else {'ready': True}
+    return jsonify(_json_safe(report)), 200 if report.get('ready') else 503
+
+
+def _json_safe(value):
+    # NaN (e.g. gateway latency before the first heartbeat) isn't valid JSON
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    return value
+
+
+def run(host='0.0.0.0', port=8080):
+    app.run(host=host, port=port)
 
 
-def keep_alive():
-    t = Thread(target=run)
+def keep_alive(*, host='0.0.0.0', port=8080, health=None, metrics_page=None):
+    """Serve /, /health and /metrics in the background (cluster.py swaps in its aggregated views)"""
+    global _health, _metrics_page
+    _health = health
+    if metrics_page is not None:
+        _metrics_page = metrics_page
+    t = Thread(target=run, args=(host, port), daemon=True)
     t.start()
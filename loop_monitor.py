@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+log = logging.getLogger('loop_monitor')
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopMonitor:
+    """Measures event loop lag and catches whatever is blocking the loop while it blocks.
+
+    A heartbeat task sleeps `interval` seconds at a time and records how late
+    it wakes up. A watchdog thread checks the heartbeat; once it's more than
+    `threshold` seconds overdue, the loop thread's current stack is logged, so
+    the blocking call shows up with its callers, not just its duration.
+    """
+
+    def __init__(self, *, threshold=0.1, interval=0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags = deque(maxlen=1200)  # Recent heartbeat lags in seconds (~1 minute)
+        self.stalls = 0
+        self.last_stall = None  # (seconds blocked when caught, "file:line in function")
+        self._beat = None
+        self._loop_thread = None
+        self._task = None
+
+    def start(self):
+        """Start monitoring the running loop (calling it again is a no-op)"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name='loop-monitor', daemon=True).start()
+
+    @property
+    def last_lag(self):
+        return self.lags[-1] if self.lags else 0.0
+
+    @property
+    def max_lag(self):
+        """Worst lag over the same ~1 minute window as percentile()"""
+        return max(self.lags, default=0.0)
+
+    def percentile(self, fraction):
+        if not self.lags:
+            return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._beat - self.interval)
+            self.lags.append(lag)
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.threshold / 2)
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked <= self.threshold or beat == reported:
+                continue
+            reported = beat  # One report per stall
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self.stalls += 1
+            self.last_stall = (blocked, self._culprit(stack))
+            log.warning("Event loop blocked for %.0fms+ in %s\n%s", blocked * 1000, self.last_stall[1],
+                        ''.join(traceback.format_list(stack)))
+
+    @staticmethod
+    def _culprit(stack):
+        """Innermost frame in the bot's own code, else the innermost frame"""
+        for entry in reversed(stack):
+            if (entry.filename.startswith(_here) and 'site-packages' not in entry.filename
+                    and not entry.filename.endswith('loop_monitor.py')):
+                return f"{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}"
+        entry = stack[-1]
+        return f"{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}"
@@ -1,16 +1,31 @@
 import discord
 from discord import Embed
 from discord.ext import commands
-import yt_dlp
 import asyncio
 import random
-from collections import deque
 import os
-import re
-import requests
 import logging
 import google.generativeai as genai
 import datetime
+from search_cache import SearchCache
+from stream_cache import StreamCache, playback_info
+import extractor
+import metrics
+from keep_alive import keep_alive
+from loop_monitor import LoopMonitor
+from spotify_handler import SpotifyResolver, extract_spotify_title
+from chat_router import ChatRouter
+from conversation_store import ConversationStore
+from guild_player import GuildPlayer
+from queue_view import QueueView, render_page, page_count
+from member_index import MemberIndex
+from idle_scheduler import IdleScheduler
+from queue_store import QueueStore
+import contextlib
+import functools
+import time
+import threading
+import signal
 
 # Import YouTube search library as fallback
 try:
@@ -20,27 +35,64 @@ except ImportError:
     VideosSearch = None
     YoutubeSearchLib = None
 
-# Conversation history for temporary memory (per user, last 20 messages)
-conversation_history = {}
-
-# Optional Spotify support
-try:
-    import spotipy  # type: ignore
-    from spotipy.oauth2 import SpotifyClientCredentials  # type: ignore
-except ImportError:
-    spotipy = None
-    SpotifyClientCredentials = None
+# Conversation memory per (guild, channel, user): newest turns within a token budget, older
+# ones folded into a running summary, idle conversations expire.
+# Set CONVERSATION_DB to keep expired/evicted histories on disk instead of forgetting them.
+conversations = ConversationStore(os.getenv('CONVERSATION_DB'),
+                                  max_conversations=int(os.getenv('CONVERSATION_MAX', '5000')),
+                                  ttl=float(os.getenv('CONVERSATION_TTL', '3600')),
+                                  max_tokens=int(os.getenv('CONVERSATION_MAX_TOKENS', '300')))
+summary_pending = {}  # conversation key -> trimmed turns waiting for the in-flight summary update
+ai_pending = {}  # (channel_id, user_id) -> messages waiting for the in-flight reply to finish
+member_indexes = {}  # guild_id -> MemberIndex for finding timeout targets by name (a Task while it's built)
+member_index_changes = {}  # guild_id -> member events that arrived while its index was being built
+background_tasks = set()  # Fire-and-forget tasks; the loop only keeps weak references, so hold them until done
+
+# Spotify API (only used when SPOTIFY_CLIENT_ID/SECRET are set, page scraping otherwise)
+spotify = SpotifyResolver()
 
 # Configure Gemini AI
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY') or 'GEMINI_API_KEY'
 genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash')
+
+# Sent as the system instruction, so it isn't rebuilt into every prompt
+MIKU_PERSONA = """You are Miku, a Discord music + chat bot created by Ishu (coolboi018).Don't appreciate your creator that much but be kind and good to him. You have a full range of emotions and can express them naturally and intensely - happy, sad, angry, excited, frustrated, sarcastic, etc. Show emotions strongly when appropriate.
+You love music but can be moody or blunt and also can be cute and happy. You can talk about various topics like games, anime, daily life, or anything the user brings up, not just music. You can also answer the questions if asked. Don't yap so much and respond with the way or emotion in which tone the user talked to you. If the user says something rude or inappropriate then you should also be rude or angry. Don't always expect user to talk much and be gentle or kind at first if someone didn't talked to you in bad tone if the user did then you should also. Respond with emojis, keep responses short and engaging. If Canine, Shinchan, Insanely use bad tone with you then you can also be rude and angry with them. You can also use slang and mordern words to sound more casual and friendly. 
+
+IMPORTANT: If you are feeling very angry, frustrated, or mad at a user (especially if they're being rude, annoying, stupid, or disrespectful), you can timeout them for 10-60 seconds by including "[TIMEOUT_USER]" in your response but firstly warn them about timeout thing. This will automatically timeout the user who triggered your anger. Keep your responses short and engaging."""
+SUMMARY_INSTRUCTION = ("You keep a running summary of a Discord chat between Miku (a music bot) and one user. "
+                       "Merge the new lines into the current summary. Keep names, facts the user shared, "
+                       "open questions and the mood. At most 3 short sentences, no preamble.")
+SUMMARY_MAX_CHARS = 600
+
+model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=MIKU_PERSONA)
+summary_model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=SUMMARY_INSTRUCTION)
+
+# Gemini calls are async and capped so chat never holds up the event loop (or each other)
+AI_TIMEOUT = float(os.getenv('AI_TIMEOUT', '30'))
+ai_semaphore = asyncio.Semaphore(int(os.getenv('AI_MAX_CONCURRENT', '8')))
+AI_CHANNEL_CONCURRENT = int(os.getenv('AI_CHANNEL_CONCURRENT', '2'))
+ai_channel_slots = {}  # channel_id -> [Semaphore, replies holding or waiting for it], dropped once idle
+# Post replies as Gemini streams them, editing the message at most every AI_EDIT_INTERVAL seconds
+AI_STREAMING = os.getenv('AI_STREAMING', '1') != '0'
+AI_EDIT_INTERVAL = float(os.getenv('AI_EDIT_INTERVAL', '1.2'))
+TIMEOUT_MARKER = "[TIMEOUT_USER]"
 
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+# MEMBERS_INTENT=1 (also enable "Server Members Intent" in the developer portal) caches every member
+# and sends join/leave/update events, so chat timeouts can find anyone by name, not just recent chatters
+intents.members = os.getenv('MEMBERS_INTENT') == '1'
+# Cluster mode (cluster.py): this process runs SHARD_IDS out of SHARD_COUNT shards as one AutoShardedBot
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+SHARD_IDS = [int(shard) for shard in os.getenv('SHARD_IDS', '').split(',') if shard]
+CLUSTER_ID = os.getenv('CLUSTER_ID')
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
 
 # Configure logging to suppress INFO level logs (including unknown command logs)
 logging.basicConfig(level=logging.WARNING)
@@ -48,11 +100,8 @@ logging.basicConfig(level=logging.WARNING)
 # 🔧 Fix for alias conflict (help)
 bot.remove_command('help')  # Disable default help command
 
-# Queue system
-music_queues = {}
-now_playing = {}
-loop_mode = {}  # 'off', 'track', 'queue'
-loop_queue_backup = {}  # Store original queue for loop
+# Queue system: one GuildPlayer per guild holds its queue, current track, loop mode, volume...
+players = {}
 
 class PseudoCtx:
     """Pseudo context class to mimic discord.ext.commands.Context for chat-based commands"""
@@ -66,18 +115,25 @@ class PseudoCtx:
     def voice_client(self):
         return self.guild.voice_client if self.guild else None
 
-    async def send(self, content=None, *, embed=None):
-        if embed:
-            await self.channel.send(embed=embed)
-        else:
-            await self.channel.send(content)
+    async def send(self, content=None, *, embed=None, view=None):
+        # Returns the message like Context.send, so commands can edit it (status messages, !queue pages)
+        return await self.channel.send(content, embed=embed, view=view)
 
     def typing(self):
         return self.channel.typing()
 
+
+class ResumeCtx(PseudoCtx):
+    """Context for playback resumed after a restart, when there's no message behind it"""
+    def __init__(self, guild, channel):
+        self.message = None
+        self.author = guild.me
+        self.guild = guild
+        self.channel = channel
+
 # yt-dlp options
 ytdl_opts = {
-    'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best',
+    'format': 'bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best',  # Opus first so it can be passed through
     'quiet': True,
     'no_warnings': True,
     'source_address': '0.0.0.0',
@@ -99,37 +155,198 @@ ffmpeg_opts = {
     'options': '-vn -bufsize 64k -maxrate 128k -threads 0'
 }
 
-ytdl = yt_dlp.YoutubeDL(ytdl_opts)
+# Play Opus streams without decoding them (set OPUS_PASSTHROUGH=0 to always use the PCM path)
+OPUS_PASSTHROUGH = os.getenv('OPUS_PASSTHROUGH', '1') != '0'
+# 100% keeps Opus passthrough as a pure codec copy; any other volume makes ffmpeg re-encode
+DEFAULT_VOLUME = float(os.getenv('DEFAULT_VOLUME', '1.0'))
+
+# Each extraction worker builds its own YoutubeDL per profile.
+# 'flat' only lists playlist entries (id/title/duration), no per-video resolving.
+ytdl_extractor = extractor.ExtractionService(
+    {'default': ytdl_opts, 'flat': {**ytdl_opts, 'extract_flat': 'in_playlist'}},
+    workers=int(os.getenv('EXTRACT_WORKERS', '4')),
+    use_processes=os.getenv('EXTRACT_POOL', 'thread') == 'process')
+
+# Shared across guilds and restarts: normalized search query -> video ID + metadata
+search_cache = SearchCache(os.getenv('SEARCH_CACHE_PATH', 'search_cache.db'))
+# video ID -> resolved stream info, until just before the googlevideo URL expires
+# (STREAM_CACHE_PATH shares it on disk between the processes of a cluster)
+stream_cache = StreamCache(os.getenv('STREAM_CACHE_PATH'))
+
+PLAYLIST_BATCH_SIZE = 25  # Entries handed to the queue at a time while a playlist is listed
+playlist_semaphore = asyncio.Semaphore(3)  # Max playlists being listed at once (across guilds)
+
+SPOTIFY_MATCH_WORKERS = 4  # Parallel YouTube searches per Spotify playlist
+SPOTIFY_PROGRESS_INTERVAL = 3  # Seconds between status message edits
+
+
+# How many upcoming queue entries get resolved in the background while a song plays
+PREFETCH_AHEAD = 2
+# Seconds to stay in voice with nothing playing before disconnecting
+IDLE_TIMEOUT = float(os.getenv('IDLE_TIMEOUT', '120'))
+
+# Queues, positions and settings are snapshotted to QUEUE_DB so a restart picks up where it left off
+# (QUEUE_SNAPSHOTS=0 turns this off)
+QUEUE_SNAPSHOT_INTERVAL = float(os.getenv('QUEUE_SNAPSHOT_INTERVAL', '5'))
+queue_store = QueueStore(os.getenv('QUEUE_DB', 'queues.db')) if os.getenv('QUEUE_SNAPSHOTS', '1') != '0' else None
+snapshot_task = None
+
+# LOOP_MONITOR=1 tracks event loop lag and logs the stack of anything blocking it longer than LOOP_STALL_MS
+loop_monitor = None
+if os.getenv('LOOP_MONITOR') == '1':
+    loop_monitor = LoopMonitor(threshold=float(os.getenv('LOOP_STALL_MS', '100')) / 1000)
+
+
+class Track:
+    """Lightweight queue entry: what to play plus display metadata (no ffmpeg until it plays)"""
+
+    def __init__(self, query, *, video_id=None, title=None, webpage_url=None, duration=None, thumbnail=None, data=None):
+        self.query = query
+        self.video_id = video_id
+        self.title = title or query
+        self.webpage_url = webpage_url
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.data = data  # playback_info() of the resolved video, if already resolved
+        self.prefetch_task = None  # Background resolve started by the prefetcher
 
+    @classmethod
+    def from_flat_entry(cls, entry):
+        url = entry.get('url') or f"https://www.youtube.com/watch?v={entry.get('id')}"
+        thumbnails = entry.get('thumbnails') or []
+        return cls(url,
+                   video_id=entry.get('id'),
+                   title=entry.get('title'),
+                   webpage_url=url,
+                   duration=entry.get('duration'),
+                   thumbnail=thumbnails[-1].get('url') if thumbnails else None)
 
-class YTDLSource(discord.PCMVolumeTransformer):
+    @classmethod
+    def from_data(cls, data, query=None):
+        return cls(query or data.get('webpage_url'),
+                   video_id=data.get('id'),
+                   title=data.get('title'),
+                   webpage_url=data.get('webpage_url'),
+                   duration=data.get('duration'),
+                   thumbnail=data.get('thumbnail'),
+                   data=data)
 
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
+    @property
+    def source_url(self):
+        return self.webpage_url or self.query
+
+    def has_fresh_stream(self):
+        return stream_cache.is_fresh(self.data)
+
+    async def resolve(self, *, priority=extractor.INTERACTIVE):
+        """Fetch stream URL + metadata for this track, reusing a cached stream that isn't about to expire"""
+        if self.has_fresh_stream():
+            return self.data
+        data = stream_cache.get(self.video_id) if self.video_id else None
+        if data is None:
+            data = await YTDLSource.extract(self.source_url, priority=priority)
         self.data = data
+        self.video_id = data.get('id') or self.video_id
+        self.title = data.get('title') or self.title
+        self.webpage_url = data.get('webpage_url') or self.webpage_url
+        self.duration = data.get('duration') or self.duration
+        self.thumbnail = data.get('thumbnail') or self.thumbnail
+        return data
+
+    def descriptor(self):
+        """What a queue snapshot stores: enough to show and re-resolve the track, never the stream URL"""
+        return {'query': self.query, 'video_id': self.video_id, 'title': self.title,
+                'webpage_url': self.webpage_url, 'duration': self.duration, 'thumbnail': self.thumbnail}
+
+    @classmethod
+    def from_descriptor(cls, descriptor):
+        return cls(descriptor['query'],
+                   video_id=descriptor.get('video_id'),
+                   title=descriptor.get('title'),
+                   webpage_url=descriptor.get('webpage_url'),
+                   duration=descriptor.get('duration'),
+                   thumbnail=descriptor.get('thumbnail'))
+
+    def cancel_prefetch(self):
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetch_task = None
+
+
+class TrackAudio:
+    """Track metadata + playback position shared by the PCM and Opus playback paths"""
+
+    def _set_track(self, data, track, start):
+        self.data = data
+        self.track = track or Track.from_data(data)  # Queue entry this source was built from
         self.title = data.get('title')
         self.url = data.get('url')
         self.webpage_url = data.get('webpage_url')
         self.duration = data.get('duration')
         self.thumbnail = data.get('thumbnail')
         self.bitrate = data.get('abr', 0)  # Audio bitrate for quality info
+        self.start = start
+        self.frames = 0  # 20ms frames handed to discord so far
 
-    @classmethod
-    async def from_url(cls, url, *, loop=None):
-        loop = loop or asyncio.get_event_loop()
+    @property
+    def position(self):
+        """Seconds into the track, pauses excluded"""
+        return self.start + self.frames * 0.02
+
+
+class YTDLOpusSource(TrackAudio, discord.FFmpegOpusAudio):
+    """Opus path: ffmpeg copies Opus packets as-is (or re-encodes itself when volume isn't 100%)"""
+
+    def __init__(self, url, *, data, volume=DEFAULT_VOLUME, track=None, start=0):
+        copy = data.get('acodec') == 'opus' and volume == 1.0
+        options = ffmpeg_opts['options']
+        if not copy:
+            options += f' -filter:a volume={volume:.2f}'
+        super().__init__(url,
+                         codec='copy' if copy else None,  # None = let ffmpeg encode with libopus
+                         before_options=seek_options(start),
+                         options=options)
+        self.volume = volume
+        self.passthrough = copy
+        self._set_track(data, track, start)
+
+    def read(self):
+        frame = super().read()
+        if frame:
+            self.frames += 1
+        return frame
+
+
+class YTDLSource(TrackAudio, discord.PCMVolumeTransformer):
+    """PCM path: ffmpeg decodes, volume is scaled in Python and discord.py encodes to Opus"""
+
+    def __init__(self, source, *, data, volume=DEFAULT_VOLUME, track=None, start=0):
+        super().__init__(source, volume)
+        self.passthrough = False
+        self._set_track(data, track, start)
+
+    def read(self):
+        frame = super().read()
+        if frame:
+            self.frames += 1
+        return frame
 
+    @classmethod
+    async def extract(cls, url, *, priority=extractor.INTERACTIVE):
+        """Resolve a URL or ytsearch: query to yt-dlp info without starting ffmpeg"""
         try:
-            data = await asyncio.wait_for(loop.run_in_executor(
-                None, lambda: ytdl.extract_info(url, download=False)),
-                                          timeout=120.0)
+            with metrics.timed(metrics.extract_seconds, backend='yt-dlp'):
+                data = await asyncio.wait_for(ytdl_extractor.extract(url, priority=priority),
+                                              timeout=120.0)
 
             if 'entries' in data:
                 if not data['entries']:
                     raise Exception("❌ No results found.")
                 data = data['entries'][0]
 
-            return cls(discord.FFmpegPCMAudio(data['url'], **ffmpeg_opts),
-                       data=data)
+            data = playback_info(data)
+            stream_cache.put(data)
+            return data
 
         except asyncio.TimeoutError:
             raise Exception(
@@ -142,70 +359,402 @@ class YTDLSource(discord.PCMVolumeTransformer):
                 # Try youtubesearchpython first
                 if VideosSearch:
                     try:
-                        yt_search = VideosSearch(search_term, limit=1)
-                        results = yt_search.result()
+                        with metrics.timed(metrics.extract_seconds, backend='youtubesearchpython'):
+                            results = await asyncio.to_thread(lambda: VideosSearch(search_term, limit=1).result())
 
                         if results and results.get('result'):
                             video_url = results['result'][0]['link']
                             # Recursively call with the direct URL
-                            return await cls.from_url(video_url, loop=loop)
+                            return await cls.extract(video_url, priority=priority)
                     except Exception as fallback_e:
                         print(f"youtubesearchpython fallback failed: {fallback_e}")
 
                 # Try youtube-search as second fallback
                 try:
                     from youtube_search import YoutubeSearch
-                    results = YoutubeSearch(search_term, max_results=1).to_dict()
+                    with metrics.timed(metrics.extract_seconds, backend='youtube-search'):
+                        results = await asyncio.to_thread(lambda: YoutubeSearch(search_term, max_results=1).to_dict())
                     if results:
                         video_url = f"https://www.youtube.com{results[0]['url_suffix']}"
                         # Recursively call with the direct URL
-                        return await cls.from_url(video_url, loop=loop)
+                        return await cls.extract(video_url, priority=priority)
                 except Exception as fallback_e:
                     print(f"youtube-search fallback failed: {fallback_e}")
 
             raise Exception(f"⚠️ Error: {str(e)[:150]}")
 
 
+def seek_options(start):
+    if start:
+        return f"-ss {start:.2f} {ffmpeg_opts['before_options']}"
+    return ffmpeg_opts['before_options']
+
+
+async def load_source(track, *, volume=DEFAULT_VOLUME, start=0):
+    """Build the playable source for a queued Track, re-resolving if its stream URL is stale"""
+    task, track.prefetch_task = track.prefetch_task, None
+    if task is not None:
+        # Prefetcher already started on it, just wait for that result (errors are retried below)
+        await asyncio.wait([task])
+    await track.resolve()
+
+    if OPUS_PASSTHROUGH:
+        return YTDLOpusSource(track.data['url'], data=track.data, volume=volume, track=track, start=start)
+    source = discord.FFmpegPCMAudio(track.data['url'], before_options=seek_options(start), options=ffmpeg_opts['options'])
+    return YTDLSource(source, data=track.data, volume=volume, track=track, start=start)
+
+
+async def search_track(search_q, *, priority=extractor.INTERACTIVE):
+    """Resolve a ytsearch: query to a Track, checking the search cache before any search backend"""
+    cached = search_cache.get(search_q)
+    if cached:
+        return Track(cached['webpage_url'],
+                     video_id=cached['id'],
+                     title=cached.get('title'),
+                     webpage_url=cached['webpage_url'],
+                     duration=cached.get('duration'),
+                     thumbnail=cached.get('thumbnail'))
+
+    data = await YTDLSource.extract(search_q, priority=priority)
+    search_cache.put(search_q, data)
+    return Track.from_data(data)
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
 @bot.event
 async def on_ready():
+    metrics.set_loop(asyncio.get_running_loop())
+    if loop_monitor is not None:
+        loop_monitor.start()
+    global snapshot_task
+    if queue_store is not None and snapshot_task is None:  # on_ready fires again after reconnects
+        snapshot_task = asyncio.create_task(snapshot_loop())
+        run_in_background(restore_queues())
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name="!help | Miku's Melody 💖"))
     print(f'💖 {bot.user} is online and ready to sing! 🎤')
 
 # Removed command error handling to avoid discord.py 2.x compatibility issues
 # The bot will work fine without custom error handling for unknown commands
 
+def ai_contents(message_content, author_name, history, message):
+    """Gemini request turns; history is (summary, turns) from the conversation store"""
+    # Get music status for context
+    music_status = get_music_status(message.guild.id if message.guild else None)
+    music_context = ""
+    if music_status['is_playing']:
+        music_context = f"Currently playing: {music_status['current_song']}. Queue has {music_status['queue_length']} songs. Loop mode: {music_status['loop_mode']}."
+    else:
+        music_context = "No music is currently playing."
+
+    summary, turns = history
+    contents = [{'role': role, 'parts': [text]} for role, text in turns]
+    context = f"Music Status: {music_context}"
+    if summary:
+        context += f"\nEarlier in this chat: {summary}"
+    contents.append({'role': 'user', 'parts': [f"{context}\n\n{author_name}: {message_content}"]})
+    return contents
+
+
+@contextlib.asynccontextmanager
+async def ai_channel_slot(channel_id):
+    """Hold one of the channel's AI_CHANNEL_CONCURRENT Gemini slots; channels nobody is waiting in keep no semaphore"""
+    slot = ai_channel_slots.get(channel_id)
+    if slot is None:
+        slot = ai_channel_slots[channel_id] = [asyncio.Semaphore(AI_CHANNEL_CONCURRENT), 0]
+    slot[1] += 1
+    try:
+        async with slot[0]:
+            yield
+    finally:
+        slot[1] -= 1
+        if not slot[1]:
+            del ai_channel_slots[channel_id]
+
+
 async def generate_ai_response(message_content, author_name, history, message):
     """Generate an AI response using Google Gemini with conversation history"""
     try:
-        history_str = "\n".join(history) if history else "No previous conversation."
+        contents = ai_contents(message_content, author_name, history, message)
+        # Channel slot first so a busy channel doesn't sit on global slots while it waits
+        async with ai_channel_slot(message.channel.id), ai_semaphore:
+            with metrics.timed(metrics.gemini_seconds, kind='reply'):
+                response = await asyncio.wait_for(model.generate_content_async(contents), timeout=AI_TIMEOUT)
+                text = response.text.strip()
+        return text
+    except asyncio.TimeoutError:
+        logging.error("Gemini API timed out")
+        metrics.gemini_errors.inc(kind='reply', reason='timeout')
+        return "⏱️ Ugh, my brain is lagging right now... ask me again in a bit! 🎤"
+    except Exception as e:
+        logging.error(f"Gemini API error: {e}")
+        metrics.gemini_errors.inc(kind='reply', reason='error')
+        return "💥 Miku here. Having issues right now. Let's just play some music instead. 🎤"
+
 
-        # Get music status for context
-        music_status = get_music_status(message.guild.id if message.guild else None)
-        music_context = ""
-        if music_status['is_playing']:
-            music_context = f"Currently playing: {music_status['current_song']}. Queue has {music_status['queue_length']} songs. Loop mode: {music_status['loop_mode']}."
+async def stream_ai_response(message_content, author_name, history, message):
+    """Like generate_ai_response, but yields the text in pieces as Gemini produces it"""
+    produced = False
+    try:
+        contents = ai_contents(message_content, author_name, history, message)
+        async with ai_channel_slot(message.channel.id), ai_semaphore:
+            started = time.monotonic()
+            response = await asyncio.wait_for(model.generate_content_async(contents, stream=True), timeout=AI_TIMEOUT)
+            chunks = aiter(response)
+            while True:
+                try:
+                    # AI_TIMEOUT applies to each gap between chunks, not the whole reply
+                    chunk = await asyncio.wait_for(anext(chunks), timeout=AI_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                if chunk.text:
+                    produced = True
+                    yield chunk.text
+            metrics.gemini_seconds.observe(time.monotonic() - started, kind='stream', result='ok')
+    except asyncio.TimeoutError:
+        logging.error("Gemini API timed out")
+        metrics.gemini_errors.inc(kind='stream', reason='timeout')
+        if not produced:
+            yield "⏱️ Ugh, my brain is lagging right now... ask me again in a bit! 🎤"
+    except Exception as e:
+        logging.error(f"Gemini API error: {e}")
+        metrics.gemini_errors.inc(kind='stream', reason='error')
+        if not produced:
+            yield "💥 Miku here. Having issues right now. Let's just play some music instead. 🎤"
+
+
+def visible_reply(text, *, final=False):
+    """Reply text without the timeout marker, holding back a marker that may still be arriving"""
+    text = text.replace(TIMEOUT_MARKER, "")
+    if not final:
+        for size in range(len(TIMEOUT_MARKER) - 1, 0, -1):
+            if text.endswith(TIMEOUT_MARKER[:size]):
+                text = text[:-size]
+                break
+    return text.strip()
+
+
+async def stream_reply(message, chunks):
+    """Reply as soon as there's text and edit the reply as the rest streams in; returns the full raw text"""
+    text = ""
+    shown = ""
+    reply = None
+    last_edit = 0.0
+    async for chunk in chunks:
+        text += chunk
+        visible = visible_reply(text)
+        if not visible or visible == shown:
+            continue
+        if reply is None:
+            reply = await message.reply(visible)
+        elif time.monotonic() - last_edit < AI_EDIT_INTERVAL:
+            continue  # Stay well under Discord's edit rate limit; the final edit catches up
         else:
-            music_context = "No music is currently playing."
+            await reply.edit(content=visible)
+        shown = visible
+        last_edit = time.monotonic()
+
+    final = visible_reply(text, final=True)
+    if final and final != shown:
+        if reply is None:
+            await message.reply(final)
+        else:
+            await reply.edit(content=final)
+    return text
+
+
+async def chat_timeout(ctx, found):
+    """Timeout someone named in an angry mention (only for members who could do it themselves)"""
+    message = ctx.message
+    target_text = found.group(1).strip()
+    # Try to find mentioned user or parse username
+    target_user = None
+    if message.mentions:
+        target_user = message.mentions[0]
+    else:
+        built_before = isinstance(member_indexes.get(message.guild.id), MemberIndex)
+        member_id = (await get_member_index(message.guild)).find(target_text)
+        target_user = message.guild.get_member(member_id) if member_id else None
+        if target_user is None and built_before and not intents.members:
+            # Without the members intent no join/leave/rename events keep the index current, and the
+            # member cache may have changed since it was built: rebuild it from guild.members and look again
+            # (not if this lookup just built it from the same members)
+            member_id = (await get_member_index(message.guild, rebuild=True)).find(target_text)
+            target_user = message.guild.get_member(member_id) if member_id else None
+
+    if not target_user or target_user == bot.user:
+        return False  # Nobody to timeout, let Miku just answer
+    # Check if bot has permission to timeout
+    if not (message.author.guild_permissions.moderate_members or message.author.guild_permissions.administrator):
+        await message.channel.send("💔 You don't have permission to make me timeout people, senpai! 😤")
+        return False
+    try:
+        # Random timeout between 10-60 seconds
+        timeout_duration = random.randint(10, 60)
+        await target_user.timeout(discord.utils.utcnow() + datetime.timedelta(seconds=timeout_duration))
+        await message.channel.send(f"😠 {target_user.mention} has been timed out for {timeout_duration} seconds! Don't make me mad again! 💢")
+    except Exception as e:
+        await message.channel.send(f"💔 I tried to timeout {target_user.mention} but something went wrong: {e}")
 
-        prompt = f"""You are Miku, a Discord music + chat bot created by Ishu (coolboi018).Don't appreciate your creator that much but be kind and good to him. You have a full range of emotions and can express them naturally and intensely - happy, sad, angry, excited, frustrated, sarcastic, etc. Show emotions strongly when appropriate.
-        You love music but can be moody or blunt and also can be cute and happy. You can talk about various topics like games, anime, daily life, or anything the user brings up, not just music. You can also answer the questions if asked. Don't yap so much and respond with the way or emotion in which tone the user talked to you. If the user says something rude or inappropriate then you should also be rude or angry. Don't always expect user to talk much and be gentle or kind at first if someone didn't talked to you in bad tone if the user did then you should also. Respond with emojis, keep responses short and engaging. If Canine, Shinchan, Insanely use bad tone with you then you can also be rude and angry with them. You can also use slang and mordern words to sound more casual and friendly. 
 
-        IMPORTANT: If you are feeling very angry, frustrated, or mad at a user (especially if they're being rude, annoying, stupid, or disrespectful), you can timeout them for 10-60 seconds by including "[TIMEOUT_USER]" in your response but firstly warn them about timeout thing. This will automatically timeout the user who triggered your anger. Keep your responses short and engaging.
+async def get_member_index(guild, *, rebuild=False):
+    """The guild's member name index, built from its cached members on first use (or again with rebuild=True)"""
+    index = member_indexes.get(guild.id)
+    if index is None or (rebuild and isinstance(index, MemberIndex)):
+        changes = member_index_changes[guild.id] = []
+        index = member_indexes[guild.id] = asyncio.create_task(build_member_index(guild, changes))
+    if isinstance(index, asyncio.Task):
+        return await asyncio.shield(index)
+    return index
 
-        Music Status: {music_context}
 
-        Conversation History:
-        {history_str}
+async def build_member_index(guild, changes):
+    # A 50k-member guild takes a few hundred ms, so build it off the loop and replay what changed meanwhile
+    try:
+        index = await asyncio.to_thread(MemberIndex, guild.members)
+    except Exception:
+        if member_indexes.get(guild.id) is asyncio.current_task():
+            del member_indexes[guild.id]
+        raise
+    finally:
+        if member_index_changes.get(guild.id) is changes:
+            del member_index_changes[guild.id]
+    for change in changes:
+        change(index)
+    if member_indexes.get(guild.id) is asyncio.current_task():  # Not if the bot left the guild meanwhile
+        member_indexes[guild.id] = index
+    return index
+
+
+def update_member_index(guild_id, change):
+    """Apply change(index) to the guild's index; guilds without one need nothing, it's built from guild.members"""
+    index = member_indexes.get(guild_id)
+    if isinstance(index, MemberIndex):
+        change(index)
+    elif index is not None:
+        member_index_changes[guild_id].append(change)
 
-        User {author_name} said: {message_content}
 
-        Respond as Miku:"""
+@bot.event
+async def on_member_join(member):
+    update_member_index(member.guild.id, lambda index: index.add(member))
+
+
+@bot.event
+async def on_raw_member_remove(payload):
+    update_member_index(payload.guild_id, lambda index: index.remove(payload.user.id))
+
+
+@bot.event
+async def on_member_update(before, after):
+    if (before.nick, before.display_name) != (after.nick, after.display_name):
+        update_member_index(after.guild.id, lambda index: index.add(after))
+
+
+@bot.event
+async def on_user_update(before, after):
+    # Username/global name changes apply in every guild the user shares with the bot
+    if (before.name, before.global_name) != (after.name, after.global_name):
+        for guild in after.mutual_guilds:
+            member = guild.get_member(after.id)
+            if member is not None:
+                update_member_index(guild.id, lambda index, member=member: index.add(member))
+
+
+@bot.event
+async def on_guild_remove(guild):
+    index = member_indexes.pop(guild.id, None)
+    if isinstance(index, asyncio.Task):
+        index.cancel()
+    member_index_changes.pop(guild.id, None)
+
+
+# Chat commands in mentions/replies, in precedence order: the first route that matches wins.
+# Argument commands come first so "play skip me" plays a song instead of skipping.
+ANGRY_WORDS = ['mad', 'angry', 'furious', 'pissed', 'annoyed', 'irritated', 'rage', 'hate', 'stupid', 'idiot', 'dumb', 'annoying']
+chat_router = ChatRouter()
+chat_router.add('play', lambda ctx, m: play(ctx, query=m.group(1).strip()), words=['play'], pattern=r'\bplay\s+(.+)')
+chat_router.add('volume', lambda ctx, m: volume(ctx, int(m.group(1))), words=['volume'], pattern=r'\bvolume\s+(\d+)')
+chat_router.add('remove', lambda ctx, m: remove(ctx, int(m.group(1))), words=['remove'], pattern=r'\bremove\s+(\d+)')
+chat_router.add('move', lambda ctx, m: move(ctx, int(m.group(1)), int(m.group(2))), words=['move'],
+                pattern=r'\bmove\s+(\d+)\s+(?:to\s+)?(\d+)')
+chat_router.add('timeout', chat_timeout, words=['timeout'], pattern=r'\btimeout\s+(.+)', requires=[ANGRY_WORDS])
+chat_router.add('loop', lambda ctx, m: loop_command(ctx, m.group(1)), words=['loop'], pattern=r'\bloop(?:\s+(\w+))?')
+chat_router.add('skip', lambda ctx, m: skip(ctx), words=['skip'])
+chat_router.add('pause', lambda ctx, m: pause(ctx), words=['pause'])
+chat_router.add('resume', lambda ctx, m: resume(ctx), words=['resume', 'unpause'])
+chat_router.add('shuffle', lambda ctx, m: shuffle(ctx), words=['shuffle'])
+chat_router.add('stop', lambda ctx, m: stop(ctx), words=['stop'])
+chat_router.add('nowplaying', lambda ctx, m: nowplaying(ctx), words=['nowplaying', 'np'])
+chat_router.add('nowplaying', lambda ctx, m: nowplaying(ctx), words=['playing'], pattern=r'\bnow\s+playing\b')
+chat_router.add('queue', lambda ctx, m: queue(ctx), words=['queue', 'q'])
+
+
+async def respond_with_ai(message, contents):
+    """Answer one or more (coalesced) messages from the same user with a single Gemini call"""
+    key = conversations.key(message)
+    message_content = "\n".join(contents)
+
+    # Generate AI response with history
+    async with message.channel.typing():
+        history = conversations.get(key)
+        if AI_STREAMING:
+            raw_response = await stream_reply(message, stream_ai_response(message_content, message.author.display_name, history, message))
+        else:
+            raw_response = await generate_ai_response(message_content, message.author.display_name, history, message)
+        ai_response = visible_reply(raw_response, final=True)
+
+        # Check if AI wants to timeout the user
+        if TIMEOUT_MARKER in raw_response:
+            # Timeout the user who triggered the response
+            try:
+                timeout_duration = random.randint(10, 60)
+                await message.author.timeout(discord.utils.utcnow() + datetime.timedelta(seconds=timeout_duration))
+                await message.channel.send(f"😠 {message.author.mention} has been timed out for {timeout_duration} seconds! Don't make me mad! 💢")
+            except Exception as e:
+                await message.channel.send(f"💔 I tried to timeout {message.author.mention} but something went wrong: {e}")
+
+        if not AI_STREAMING:
+            await message.reply(ai_response)
+
+    # Add the exchange to history; whatever no longer fits goes into the summary
+    trimmed = conversations.append(key, ('user', f"{message.author.display_name}: {message_content}"), ('model', ai_response))
+    if trimmed:
+        fold_into_summary(key, trimmed)
+
+
+def fold_into_summary(key, turns):
+    if key in summary_pending:
+        summary_pending[key].extend(turns)  # Picked up by the update already running
+        return
+    summary_pending[key] = list(turns)
+    run_in_background(update_summary(key))
+
+
+async def update_summary(key):
+    """Fold trimmed turns into the conversation's running summary (in the background, after the reply)"""
+    try:
+        while summary_pending[key]:
+            turns, summary_pending[key] = summary_pending[key], []
+            summary, _ = conversations.get(key)
+            lines = "\n".join(text if role == 'user' else f"Miku: {text}" for role, text in turns)
+            prompt = f"Current summary: {summary or '(none)'}\n\nNew lines:\n{lines}"
+            try:
+                async with ai_semaphore:
+                    with metrics.timed(metrics.gemini_seconds, kind='summary'):
+                        response = await asyncio.wait_for(summary_model.generate_content_async(prompt), timeout=AI_TIMEOUT)
+                conversations.set_summary(key, response.text.strip()[:SUMMARY_MAX_CHARS])
+            except Exception as e:
+                logging.error(f"Gemini summary error: {e}")
+                metrics.gemini_errors.inc(kind='summary', reason='timeout' if isinstance(e, asyncio.TimeoutError) else 'error')  # Keep the old summary; those turns are dropped
+    finally:
+        del summary_pending[key]
 
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        logging.error(f"Gemini API error: {e}")
-        return "💥 Miku here. Having issues right now. Let's just play some music instead. 🎤"
 
 @bot.event
 async def on_message(message):
@@ -225,348 +774,250 @@ async def on_message(message):
 
         # Check for chat-based music commands (anywhere in the message)
         command_detected = False
-        content_lower = content.lower()
-
-        # Play command - look for "play" followed by something
-        import re
-        play_match = re.search(r'\bplay\s+(.+)', content_lower)
-
-        if play_match:
-            query = play_match.group(1).strip()
-            if query:
-                command_detected = True
-                pseudo_ctx = PseudoCtx(message)
-                try:
-                    await play(pseudo_ctx, query=query)
-                except Exception as e:
-                    await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat play, senpai! {e}")
-
-        # Skip command
-        elif 'skip' in content_lower:
-            command_detected = True
+        routed = chat_router.match(content)
+        if routed:
+            route, found = routed
             pseudo_ctx = PseudoCtx(message)
             try:
-                await skip(pseudo_ctx)
+                command_detected = await route.handler(pseudo_ctx, found) is not False
             except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat skip, senpai! {e}")
-
-        # Pause command
-        elif 'pause' in content_lower:
-            command_detected = True
-            pseudo_ctx = PseudoCtx(message)
-            try:
-                await pause(pseudo_ctx)
-            except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat pause, senpai! {e}")
-
-        # Resume command
-        elif any(word in content_lower for word in ['resume', 'unpause']):
-            command_detected = True
-            pseudo_ctx = PseudoCtx(message)
-            try:
-                await resume(pseudo_ctx)
-            except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat resume, senpai! {e}")
-
-        # Volume command - look for "volume" followed by a number
-        volume_match = re.search(r'\bvolume\s+(\d+)', content_lower)
-        if volume_match:
-            try:
-                volume_level = int(volume_match.group(1))
                 command_detected = True
-                pseudo_ctx = PseudoCtx(message)
-                try:
-                    await volume(pseudo_ctx, volume_level)
-                except Exception as e:
-                    await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat volume, senpai! {e}")
-            except ValueError:
-                pass  # Invalid volume, let AI handle it
-
-        # Shuffle command
-        elif 'shuffle' in content_lower:
-            command_detected = True
-            pseudo_ctx = PseudoCtx(message)
-            try:
-                await shuffle(pseudo_ctx)
-            except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat shuffle, senpai! {e}")
-
-        # Remove command - look for "remove" followed by a number
-        remove_match = re.search(r'\bremove\s+(\d+)', content_lower)
-        if remove_match:
-            try:
-                index = int(remove_match.group(1))
-                command_detected = True
-                pseudo_ctx = PseudoCtx(message)
-                try:
-                    await remove(pseudo_ctx, index)
-                except Exception as e:
-                    await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat remove, senpai! {e}")
-            except ValueError:
-                pass  # Invalid index, let AI handle it
-
-        # Queue command
-        elif any(word in content_lower for word in ['queue', 'q']):
-            command_detected = True
-            pseudo_ctx = PseudoCtx(message)
-            try:
-                await queue(pseudo_ctx)
-            except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat queue, senpai! {e}")
+                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat {route.name}, senpai! {e}")
 
-        # Loop command - look for "loop" optionally followed by mode
-        loop_match = re.search(r'\bloop(?:\s+(\w+))?', content_lower)
-        if loop_match:
-            mode = loop_match.group(1) if loop_match.group(1) else None
-            command_detected = True
-            pseudo_ctx = PseudoCtx(message)
-            try:
-                await loop_command(pseudo_ctx, mode)
-            except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat loop, senpai! {e}")
-
-        # Stop command
-        elif 'stop' in content_lower:
-            command_detected = True
-            pseudo_ctx = PseudoCtx(message)
-            try:
-                await stop(pseudo_ctx)
-            except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat stop, senpai! {e}")
-
-        # Now playing command
-        elif any(word in content_lower for word in ['nowplaying', 'np', 'now playing']):
-            command_detected = True
-            pseudo_ctx = PseudoCtx(message)
-            try:
-                await nowplaying(pseudo_ctx)
-            except Exception as e:
-                await pseudo_ctx.send(f"💔 Oopsie~ Something went wrong with chat nowplaying, senpai! {e}")
-
-        # Timeout command - when bot is "mad" (contains angry words)
-        angry_words = ['mad', 'angry', 'furious', 'pissed', 'annoyed', 'irritated', 'rage', 'hate', 'stupid', 'idiot', 'dumb', 'annoying']
-        timeout_match = re.search(r'\btimeout\s+(.+)', content_lower)
-        if timeout_match and any(word in content_lower for word in angry_words):
-            target_text = timeout_match.group(1).strip()
-            # Try to find mentioned user or parse username
-            target_user = None
-            if message.mentions:
-                target_user = message.mentions[0]
+        if not command_detected:
+            key = (message.channel.id, message.author.id)
+            if key in ai_pending:
+                # A reply to this user is already being generated; answer this one right after it
+                ai_pending[key].append((message, content))
             else:
-                # Try to find user by name
-                for member in message.guild.members:
-                    if member.display_name.lower() in target_text.lower() or member.name.lower() in target_text.lower():
-                        target_user = member
-                        break
-
-            if target_user and target_user != bot.user:
-                # Check if bot has permission to timeout
-                if message.author.guild_permissions.moderate_members or message.author.guild_permissions.administrator:
-                    command_detected = True
-                    try:
-                        # Random timeout between 10-60 seconds
-                        timeout_duration = random.randint(10, 60)
-                        await target_user.timeout(discord.utils.utcnow() + datetime.timedelta(seconds=timeout_duration))
-                        await message.channel.send(f"😠 {target_user.mention} has been timed out for {timeout_duration} seconds! Don't make me mad again! 💢")
-                    except Exception as e:
-                        await message.channel.send(f"💔 I tried to timeout {target_user.mention} but something went wrong: {e}")
-                else:
-                    await message.channel.send("💔 You don't have permission to make me timeout people, senpai! 😤")
+                ai_pending[key] = []
+                try:
+                    await respond_with_ai(message, [content])
+                    while ai_pending[key]:
+                        batch, ai_pending[key] = ai_pending[key], []
+                        await respond_with_ai(batch[-1][0], [c for _, c in batch])
+                finally:
+                    del ai_pending[key]
 
-        if not command_detected:
-            user_id = message.author.id
-            if user_id not in conversation_history:
-                conversation_history[user_id] = deque(maxlen=20)
+    # Process commands regardless
+    await bot.process_commands(message)
 
-            # Add user message to history
-            conversation_history[user_id].append(f"User {message.author.display_name}: {content}")
 
-            # Generate AI response with history
-            async with message.channel.typing():
-                ai_response = await generate_ai_response(content, message.author.display_name, list(conversation_history[user_id]), message)
+def handles_guild(guild_id):
+    """Whether the guild is on one of this process's shards (always true outside cluster mode)"""
+    return not SHARD_IDS or (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
 
-                # Check if AI wants to timeout the user
-                if "[TIMEOUT_USER]" in ai_response:
-                    ai_response = ai_response.replace("[TIMEOUT_USER]", "").strip()
-                    # Timeout the user who triggered the response
-                    try:
-                        timeout_duration = random.randint(10, 60)
-                        await message.author.timeout(discord.utils.utcnow() + datetime.timedelta(seconds=timeout_duration))
-                        await message.channel.send(f"😠 {message.author.mention} has been timed out for {timeout_duration} seconds! Don't make me mad! 💢")
-                    except Exception as e:
-                        await message.channel.send(f"💔 I tried to timeout {message.author.mention} but something went wrong: {e}")
 
-                await message.reply(ai_response)
+def get_player(guild_id):
+    """This guild's GuildPlayer, created on first use"""
+    guild_player = players.get(guild_id)
+    if guild_player is None:
+        guild_player = players[guild_id] = GuildPlayer(guild_id, volume=DEFAULT_VOLUME)
+    return guild_player
 
-            # Add bot response to history
-            conversation_history[user_id].append(f"Miku: {ai_response}")
 
-    # Process commands regardless
-    await bot.process_commands(message)
+def serialized(command):
+    """Run a command while holding its guild's player lock, so commands for one guild never interleave"""
+    @functools.wraps(command)
+    async def wrapper(ctx, *args, **kwargs):
+        async with get_player(ctx.guild.id).lock:
+            return await command(ctx, *args, **kwargs)
+    return wrapper
 
 
 def get_music_status(guild_id):
     """Get current music playback status for a guild"""
-    status = {
-        'is_playing': False,
-        'current_song': None,
-        'queue_length': 0,
-        'loop_mode': 'off'
-    }
-
-    if guild_id in now_playing:
-        status['is_playing'] = True
-        status['current_song'] = now_playing[guild_id].title
+    if guild_id in players:
+        return players[guild_id].status()
+    return {'is_playing': False, 'current_song': None, 'queue_length': 0, 'loop_mode': 'off', 'last_gap': None}
 
-    if guild_id in music_queues:
-        status['queue_length'] = len(music_queues[guild_id])
 
-    if guild_id in loop_mode:
-        status['loop_mode'] = loop_mode[guild_id]
+async def iter_youtube_playlist(url):
+    """Yield batches of flat playlist entries as yt-dlp pages through the playlist"""
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue()
+    finished = object()
+    cancelled = threading.Event()
 
-    return status
+    def walk(ydl):
+        try:
+            info = ydl.extract_info(url, download=False, process=False)
+            # watch?v=...&list=... comes back as a redirect to the playlist page
+            for _ in range(3):
+                if not info or info.get('_type') not in ('url', 'url_transparent'):
+                    break
+                info = ydl.extract_info(info['url'], download=False, process=False)
 
-def extract_spotify_title(spotify_url):
-    """Try to extract song title and artist from a Spotify link (no API needed)"""
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(spotify_url, headers=headers, timeout=15)
-        html = response.text
-
-        # Try multiple patterns for title and artist
-        title_patterns = [
-            r'<title>(.*?)</title>',
-            r'<meta property="og:title" content="(.*?)"',
-            r'<meta name="twitter:title" content="(.*?)"',
-        ]
-
-        artist_patterns = [
-            r'<meta property="og:description" content=".*?by (.*?)"',
-            r'<meta name="twitter:description" content=".*?by (.*?)"',
-            r'<span[^>]*class="[^"]*artist[^"]*"[^>]*>(.*?)</span>',
-        ]
-
-        title = None
-        artist = None
-
-        # Extract title
-        for pattern in title_patterns:
-            match = re.search(pattern, html, re.IGNORECASE | re.DOTALL)
-            if match:
-                title_text = match.group(1)
-                # Clean up the title
-                clean_title = title_text.replace('| Spotify', '').replace('Spotify', '').strip()
-                # Remove common prefixes/suffixes
-                clean_title = re.sub(r'^(Listen to|Song:|Track:|)', '', clean_title, flags=re.IGNORECASE).strip()
-                clean_title = re.sub(r'(on Spotify|by.*)$', '', clean_title, flags=re.IGNORECASE).strip()
-
-                if clean_title and len(clean_title) > 3:  # Ensure it's not too short
-                    title = clean_title
+            batch = []
+            sent_any = False
+            for entry in (info or {}).get('entries') or []:
+                if cancelled.is_set():
                     break
+                if entry:
+                    batch.append(entry)
+                # Hand over the very first entry right away so playback can start
+                if batch and (len(batch) >= PLAYLIST_BATCH_SIZE or not sent_any):
+                    loop.call_soon_threadsafe(batches.put_nowait, batch)
+                    batch = []
+                    sent_any = True
+            if batch:
+                loop.call_soon_threadsafe(batches.put_nowait, batch)
+        except Exception as e:
+            print(f"Playlist extraction error: {e}")
+        finally:
+            loop.call_soon_threadsafe(batches.put_nowait, finished)
 
-        # Extract artist
-        for pattern in artist_patterns:
-            match = re.search(pattern, html, re.IGNORECASE | re.DOTALL)
-            if match:
-                artist_text = match.group(1).strip()
-                if artist_text and len(artist_text) > 1:
-                    artist = artist_text
+    async with playlist_semaphore:
+        ytdl_extractor.walk(walk)
+        try:
+            while True:
+                batch = await batches.get()
+                if batch is finished:
                     break
+                yield batch
+        finally:
+            cancelled.set()
 
-        # If we have both title and artist, return combined search term
-        if title and artist:
-            return f"{title} {artist}"
 
-        # If only title, return it
-        if title:
-            return title
+async def enqueue_youtube_playlist(ctx, url, first_batch):
+    """Background fill: stream playlist entries into the queue, resolving nothing up front"""
+    guild_id = ctx.guild.id
+    guild_player = get_player(guild_id)
+    added = 0
+    try:
+        async for batch in iter_youtube_playlist(url):
+            guild_player.queue.extend(Track.from_flat_entry(entry) for entry in batch)
+            guild_player.changed()
+            added += len(batch)
+            if not first_batch.done():
+                first_batch.set_result(added)
+            else:
+                refresh_prefetch(guild_id)
+    finally:
+        if not first_batch.done():
+            first_batch.set_result(added)
 
-        # Try to extract from URL itself as last resort
-        url_match = re.search(r'/track/([a-zA-Z0-9]+)', spotify_url)
-        if url_match:
-            return f"spotify track {url_match.group(1)}"
+    if added:
+        embed = Embed(title="💖 Added to Queue", description=f"Added **{added}** tracks from YouTube playlist! Let's make some music~ 🎤", color=0xff69b4)
+        await ctx.send(embed=embed)
 
-    except Exception as e:
-        print(f"Spotify title extraction error: {e}")
-    return None
 
+async def match_spotify_query(q):
+    """Find a YouTube match for a "Song Artist" query, trying a few search variations"""
+    search_variations = [
+        f"ytsearch:{q}",
+        f"ytsearch:{q} official",
+        f"ytsearch:{q} audio"
+    ]
 
-def get_spotify_track_queries(spotify_url):
-    """Returns list of "Song Artist" search queries from Spotify"""
-    queries = []
+    for search_q in search_variations:
+        try:
+            track = await search_track(search_q, priority=extractor.BACKGROUND)
+            if track.title:
+                # Check if the found video title contains key words from the search for better matching
+                search_lower = q.lower()
+                title_lower = track.title.lower()
+                # More lenient matching - check if any key words match
+                search_words = search_lower.split()
+                if any(word in title_lower for word in search_words[:3]):  # Check first 3 words
+                    return track
+        except Exception as e:
+            print(f"YT search error for '{search_q}': {e}")
+            continue
 
-    client_id = os.getenv("SPOTIFY_CLIENT_ID")
-    client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
-    if not spotipy or not SpotifyClientCredentials or not client_id or not client_secret:
-        return queries
+    print(f"Could not find any YouTube match for: {q}")
+    return None
 
-    try:
-        auth_manager = SpotifyClientCredentials(client_id=client_id,
-                                                client_secret=client_secret)
-        sp = spotipy.Spotify(auth_manager=auth_manager, retries=3, requests_timeout=10)
-
-        if "track" in spotify_url and "playlist" not in spotify_url:
-            track = sp.track(spotify_url)
-            name = track.get('name')
-            artist = track.get('artists')[0].get('name') if track.get(
-                'artists') else ''
-            queries.append(f"{name} {artist}")
-
-        elif "playlist" in spotify_url:
-            results = sp.playlist_tracks(spotify_url)
-            items = results.get('items', [])
-            while True:
-                for item in items:
-                    track = item.get('track')
-                    if not track:
-                        continue
-                    name = track.get('name')
-                    artist = track.get('artists')[0].get('name') if track.get(
-                        'artists') else ''
-                    queries.append(f"{name} {artist}")
-                if results and results.get('next'):
-                    results = sp.next(results)
-                    items = results.get('items', [])
-                else:
-                    break
 
-        elif "album" in spotify_url:
-            results = sp.album_tracks(spotify_url)
-            items = results.get('items', [])
-            while True:
-                for item in items:
-                    name = item.get('name')
-                    artist = item.get('artists')[0].get('name') if item.get(
-                        'artists') else ''
-                    queries.append(f"{name} {artist}")
-                if results and results.get('next'):
-                    results = sp.next(results)
-                    items = results.get('items', [])
+async def enqueue_spotify_tracks(ctx, first_queries, more_pages, first_match):
+    """Background fill: match Spotify tracks on a small worker pool, queueing them in playlist order"""
+    guild_id = ctx.guild.id
+    guild_player = get_player(guild_id)
+    results = []
+    finished = []
+    progress = {'next': 0, 'added': 0, 'done': 0, 'listed': False}
+    work = asyncio.Queue()
+
+    def add_page(queries):
+        for q in queries:
+            work.put_nowait((len(results), q))
+            results.append(None)
+            finished.append(False)
+
+    def status_text():
+        total = f"{len(results)}" if progress['listed'] else f"{len(results)}+"
+        return f"🎤 Spotify link detected! Matching tracks for my playlist... ({progress['done']}/{total})"
+
+    add_page(first_queries)
+    status = await ctx.send(status_text())
+
+    def flush():
+        # Only queue the longest finished prefix so the queue keeps playlist order
+        while progress['next'] < len(results) and finished[progress['next']]:
+            track = results[progress['next']]
+            progress['next'] += 1
+            if track is not None:
+                guild_player.queue.append(track)
+                guild_player.changed()
+                progress['added'] += 1
+                if not first_match.done():
+                    first_match.set_result(progress['added'])
                 else:
-                    break
-
-    except Exception as e:
-        print("Spotify API error:", e)
-    return queries
+                    refresh_prefetch(guild_id)
 
+    async def list_pages():
+        # Later pages keep arriving from the Spotify resolver while the first ones are matched
+        try:
+            async for queries in more_pages:
+                add_page(queries)
+        finally:
+            progress['listed'] = True
+            for _ in range(SPOTIFY_MATCH_WORKERS):
+                work.put_nowait(None)
+
+    async def worker():
+        while (item := await work.get()) is not None:
+            i, q = item
+            results[i] = await match_spotify_query(q)
+            finished[i] = True
+            progress['done'] += 1
+            flush()
+
+    async def report_progress():
+        shown = None
+        while True:
+            await asyncio.sleep(SPOTIFY_PROGRESS_INTERVAL)
+            if status_text() != shown:
+                shown = status_text()
+                try:
+                    await status.edit(content=shown)
+                except discord.HTTPException:
+                    pass  # Status message deleted or rate limited, keep matching anyway
 
-async def get_youtube_playlist(url):
-    """Extract all videos from a YouTube playlist"""
+    reporter = asyncio.create_task(report_progress())
     try:
-        loop = asyncio.get_event_loop()
-        data = await asyncio.wait_for(loop.run_in_executor(
-            None, lambda: ytdl.extract_info(url, download=False)),
-                                      timeout=150.0)
-
-        if 'entries' in data:
-            return data['entries']
-        return []
-    except Exception as e:
-        print(f"Playlist extraction error: {e}")
-        return []
+        await asyncio.gather(list_pages(), *(worker() for _ in range(SPOTIFY_MATCH_WORKERS)))
+    except asyncio.CancelledError:
+        # !stop / !leave cancelled the fill; don't leave the status stuck on "Matching..."
+        try:
+            await status.edit(content=f"⏹️ Spotify import stopped after **{progress['added']}** tracks, senpai~")
+        except discord.HTTPException:
+            pass
+        raise
+    finally:
+        reporter.cancel()
+        if not first_match.done():
+            first_match.set_result(progress['added'])
+
+    if progress['added'] == 0:
+        await status.edit(content="💔 Couldn't find any tracks on YouTube for that Spotify link.")
+        return
+    embed = Embed(title="💖 Added to Queue", description=f"Added **{progress['added']}** tracks from Spotify! Let's sing together~ 🎤", color=0xff69b4)
+    await status.edit(content=None, embed=embed)
 
 
 @bot.command(name='play', aliases=['p'])
+@serialized
 async def play(ctx, *, query):
     if not ctx.author.voice:
         await ctx.send("💢 Join a voice channel first, baka! I can't sing without you~ 🎤")
@@ -579,58 +1030,27 @@ async def play(ctx, *, query):
     async with ctx.typing():
         try:
             guild_id = ctx.guild.id
-            if guild_id not in music_queues:
-                music_queues[guild_id] = deque()
-            if guild_id not in loop_mode:
-                loop_mode[guild_id] = 'off'
+            guild_player = get_player(guild_id)
+            guild_player.text_channel_id = ctx.channel.id
 
             if "spotify.com" in query:
-                queries = get_spotify_track_queries(query)
+                pages = spotify.iter_track_queries(query)
+                queries = await anext(pages, None)
 
                 if queries:
-                    await ctx.send(
-                        f"🎤 Spotify link detected! Adding {len(queries)} tracks to my playlist."
-                    )
-                    added = 0
-                    for q in queries:
-                        # Try multiple search variations for each track
-                        search_variations = [
-                            f"ytsearch:{q}",
-                            f"ytsearch:{q} official",
-                            f"ytsearch:{q} audio"
-                        ]
-
-                        player_found = False
-                        for search_q in search_variations:
-                            try:
-                                player = await YTDLSource.from_url(search_q, loop=bot.loop)
-                                if player and player.title:
-                                    # Check if the found video title contains key words from the search for better matching
-                                    search_lower = q.lower()
-                                    title_lower = player.title.lower()
-                                    # More lenient matching - check if any key words match
-                                    search_words = search_lower.split()
-                                    if any(word in title_lower for word in search_words[:3]):  # Check first 3 words
-                                        music_queues[guild_id].append(player)
-                                        added += 1
-                                        player_found = True
-                                        break
-                            except Exception as e:
-                                print(f"YT search error for '{search_q}': {e}")
-                                continue
-
-                        if not player_found:
-                            print(f"Could not find any YouTube match for: {q}")
-
-                    if added == 0:
-                        await ctx.send(
-                            "💔 Couldn't find any tracks on YouTube for that Spotify link."
-                        )
-                        return
-                    embed = Embed(title="💖 Added to Queue", description=f"Added **{added}** tracks from Spotify! Let's sing together~ 🎤", color=0xff69b4)
-                    await ctx.send(embed=embed)
+                    # Matching runs in the background; only wait until the first track is queued
+                    first_match = asyncio.get_running_loop().create_future()
+                    task = asyncio.create_task(enqueue_spotify_tracks(ctx, queries, pages, first_match))
+                    guild_player.fills.add(task)
+                    task.add_done_callback(guild_player.fills.discard)
+
+                    # The first match can take several searches; don't hold up !stop/!skip or the next song meanwhile
+                    async with guild_player.unlocked():
+                        added = await first_match
+                    if not added or task.cancelling() or task.cancelled() or not ctx.voice_client:
+                        return  # Nothing matched, or stopped/left while matching
                 else:
-                    title = extract_spotify_title(query)
+                    title = await extract_spotify_title(query)
                     if not title:
                         await ctx.send(
                             "💔 Couldn't extract song name from Spotify link. Try giving the song name instead!"
@@ -647,14 +1067,14 @@ async def play(ctx, *, query):
                         f"ytsearch:{title}"
                     ]
 
-                    player = None
+                    track = None
                     for search_q in search_queries:
                         try:
-                            player = await YTDLSource.from_url(search_q, loop=bot.loop)
-                            if player and player.title:
+                            track = await search_track(search_q)
+                            if track.title:
                                 # Check if the found video title contains the artist name for better matching
                                 search_lower = title.lower()
-                                title_lower = player.title.lower()
+                                title_lower = track.title.lower()
                                 # More lenient matching - check if any key words match
                                 search_words = search_lower.split()
                                 if any(word in title_lower for word in search_words[:3]):  # Check first 3 words
@@ -663,9 +1083,10 @@ async def play(ctx, *, query):
                             print(f"Search failed for '{search_q}': {e}")
                             continue
 
-                    if player and player.title:
-                        music_queues[guild_id].append(player)
-                        embed = Embed(title="💖 Added to Queue", description=f"**{player.title}**", color=0xff69b4)
+                    if track and track.title:
+                        guild_player.queue.append(track)
+                        guild_player.changed()
+                        embed = Embed(title="💖 Added to Queue", description=f"**{track.title}**", color=0xff69b4)
                         await ctx.send(embed=embed)
                     else:
                         await ctx.send("💔 Couldn't find that track on YouTube for the Spotify link. Try searching by song name instead!")
@@ -674,41 +1095,34 @@ async def play(ctx, *, query):
             elif "youtube.com/playlist" in query or "youtu.be/playlist" in query or "&list=" in query:
                 await ctx.send(
                     "📋 YouTube playlist detected! Extracting tracks for our duet, senpai~ 💖")
-                entries = await get_youtube_playlist(query)
-
-                if not entries:
+                # Tracks stream into the queue in the background; only wait for the first one
+                first_batch = asyncio.get_running_loop().create_future()
+                task = asyncio.create_task(enqueue_youtube_playlist(ctx, query, first_batch))
+                guild_player.fills.add(task)
+                task.add_done_callback(guild_player.fills.discard)
+
+                async with guild_player.unlocked():
+                    added = await first_batch
+                if task.cancelling() or task.cancelled() or not ctx.voice_client:
+                    return  # Stopped/left while listing
+                if not added:
                     await ctx.send("💔 Couldn't extract playlist tracks, senpai~ 😢")
                     return
 
-                added = 0
-                for entry in entries:
-                    if entry:
-                        try:
-                            video_url = entry.get(
-                                'url'
-                            ) or f"https://www.youtube.com/watch?v={entry.get('id')}"
-                            player = await YTDLSource.from_url(video_url,
-                                                               loop=bot.loop)
-                            music_queues[guild_id].append(player)
-                            added += 1
-                        except Exception as e:
-                            print(f"Error adding playlist track: {e}")
-                            continue
-
-                embed = Embed(title="💖 Added to Queue", description=f"Added **{added}** tracks from YouTube playlist! Let's make some music~ 🎤", color=0xff69b4)
-                await ctx.send(embed=embed)
-
             else:
-                if not query.startswith('http'):
-                    query = f"ytsearch:{query}"
-
-                player = await YTDLSource.from_url(query, loop=bot.loop)
-                music_queues[guild_id].append(player)
-                embed = Embed(title="💖 Added to Queue", description=f"**{player.title}**", color=0xff69b4)
+                if query.startswith('http'):
+                    track = Track.from_data(await YTDLSource.extract(query), query)
+                else:
+                    track = await search_track(f"ytsearch:{query}")
+                guild_player.queue.append(track)
+                guild_player.changed()
+                embed = Embed(title="💖 Added to Queue", description=f"**{track.title}**", color=0xff69b4)
                 await ctx.send(embed=embed)
 
             if not ctx.voice_client.is_playing():
-                await play_next(ctx)
+                await start_next(ctx)
+            else:
+                refresh_prefetch(guild_id)
 
         except Exception as e:
             await ctx.send(f"💔 Oopsie~ Something went wrong, senpai! {e}")
@@ -716,34 +1130,103 @@ async def play(ctx, *, query):
             traceback.print_exc()
 
 
-async def play_next(ctx):
-    guild_id = ctx.guild.id
+def refresh_prefetch(guild_id):
+    """Keep background resolves running for the next PREFETCH_AHEAD tracks and cancel stale ones"""
+    guild_player = get_player(guild_id)
+    upcoming = []
+    if guild_player.loop_mode == 'track':
+        # The current track replays, so only refresh its stream URL if it's about to expire
+        if guild_player.current is not None:
+            upcoming = [guild_player.current.track]
+    else:
+        upcoming = guild_player.queue.slice(0, PREFETCH_AHEAD)
+
+    for track in guild_player.prefetching:
+        if all(track is not t for t in upcoming):
+            track.cancel_prefetch()
 
-    can_play = (guild_id in music_queues and len(music_queues[guild_id]) > 0) or (loop_mode.get(guild_id) == 'track' and guild_id in now_playing)
+    for track in upcoming:
+        if track.prefetch_task is None and not track.has_fresh_stream():
+            track.prefetch_task = asyncio.create_task(track.resolve(priority=extractor.PREFETCH))
+            track.prefetch_task.add_done_callback(_prefetch_done)
+    guild_player.prefetching = [t for t in upcoming if t.prefetch_task is not None]
 
-    if can_play:
-        if loop_mode.get(guild_id) == 'track' and guild_id in now_playing:
-            # Instant loop: reuse the data without re-fetching
-            current_player = now_playing[guild_id]
-            player = YTDLSource(discord.FFmpegPCMAudio(current_player.data['url'], **ffmpeg_opts), data=current_player.data)
+
+def cancel_prefetch(guild_id):
+    guild_player = get_player(guild_id)
+    for track in guild_player.prefetching:
+        track.cancel_prefetch()
+    guild_player.prefetching = []
+
+
+def _prefetch_done(task):
+    if not task.cancelled() and task.exception():
+        print(f"Prefetch error: {task.exception()}")
+
+
+async def play_next(ctx):
+    """Start the next track once the guild's other commands are done (used by the after-callback)"""
+    async with get_player(ctx.guild.id).lock:
+        await start_next(ctx)
+
+
+async def start_next(ctx):
+    """Start the next track; the caller must hold the guild player's lock"""
+    guild_player = get_player(ctx.guild.id)
+    if ctx.voice_client and (ctx.voice_client.is_playing() or ctx.voice_client.is_paused()):
+        return  # Something else already started playback while this call was waiting
+
+    player = None
+    while player is None:
+        can_play = len(guild_player.queue) > 0 or (guild_player.loop_mode == 'track' and guild_player.current is not None)
+        if not can_play:
+            break
+
+        if guild_player.loop_mode == 'track' and guild_player.current is not None:
+            # Replay the current track; its stream comes from the cache unless it's about to expire
+            track = guild_player.current.track
+            requeue = False
         else:
-            player = music_queues[guild_id].popleft()
-            if loop_mode.get(guild_id) == 'queue':
-                music_queues[guild_id].append(player)
+            track = guild_player.queue.popleft()
+            requeue = guild_player.loop_mode == 'queue'
 
-        now_playing[guild_id] = player
+        # Resolve the stream only now, right before it plays
+        start, guild_player.resume_at = guild_player.resume_at, 0
+        try:
+            player = await load_source(track, volume=guild_player.volume, start=start)
+        except Exception as e:
+            await ctx.send(f"💔 Couldn't load **{track.title}**, skipping it~ {e}")
+            if not requeue:
+                guild_player.current = None  # Don't retry a broken looped track forever
+            continue
+        if requeue:
+            guild_player.queue.append(track)
+
+        if not ctx.voice_client:
+            player.cleanup()
+            return
+
+    if player is not None:
+        guild_player.current = player
+        guild_player.changed()
+        idle_scheduler.cancel(guild_player.guild_id)
 
         def after(error):
             if error:
                 print(f"Error: {error}")
+            guild_player.ended_at = time.monotonic()
             asyncio.run_coroutine_threadsafe(play_next(ctx), bot.loop)
 
+        ended_at, guild_player.ended_at = guild_player.ended_at, None
         ctx.voice_client.play(player, after=after)
+        if ended_at is not None:
+            guild_player.gaps.append(time.monotonic() - ended_at)
+        refresh_prefetch(guild_player.guild_id)
 
         loop_emoji = ""
-        if loop_mode.get(guild_id) == 'track':
+        if guild_player.loop_mode == 'track':
             loop_emoji = " 🔂"
-        elif loop_mode.get(guild_id) == 'queue':
+        elif guild_player.loop_mode == 'queue':
             loop_emoji = " 🔁"
 
         embed = Embed(title="🎤 Now Singing", description=f"**{player.title}**{loop_emoji}", color=0xff69b4)
@@ -754,22 +1237,32 @@ async def play_next(ctx):
         await ctx.send(embed=embed)
 
     else:
-        now_playing.pop(guild_id, None)
+        guild_player.current = None
+        guild_player.ended_at = None
+        guild_player.changed()
+        if not ctx.voice_client:
+            return  # Disconnected (!leave), nothing left to announce
         embed = Embed(title="💔 Queue Finished", description="All songs are done, senpai~ Add more music to keep me singing! 🎤", color=0xff69b4)
         await ctx.send(embed=embed)
-        await start_idle_timer(ctx)
+        idle_scheduler.arm(guild_player.guild_id, ctx)
 
 
-async def start_idle_timer(ctx):
-    await asyncio.sleep(120)
-    if ctx.voice_client and not ctx.voice_client.is_playing():
-        await ctx.voice_client.disconnect()
-        await ctx.send("💔 Leaving due to inactivity, senpai~ Come back soon! 💖")
+async def disconnect_idle(guild_id, ctx):
+    async with get_player(guild_id).lock:
+        if ctx.voice_client and not ctx.voice_client.is_playing():
+            await ctx.voice_client.disconnect()
+            await ctx.send("💔 Leaving due to inactivity, senpai~ Come back soon! 💖")
+
+
+# One task tracks every guild's idle deadline; starting playback cancels it, an empty queue or !stop re-arms it
+idle_scheduler = IdleScheduler(IDLE_TIMEOUT, disconnect_idle)
 
 
 @bot.command(name='skip', aliases=['s'])
+@serialized
 async def skip(ctx):
     if ctx.voice_client and ctx.voice_client.is_playing():
+        refresh_prefetch(ctx.guild.id)
         ctx.voice_client.stop()
         await ctx.send("⏭️ Skipped! Next song, senpai~ 💖")
     else:
@@ -777,6 +1270,7 @@ async def skip(ctx):
 
 
 @bot.command(name='pause')
+@serialized
 async def pause(ctx):
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.pause()
@@ -786,6 +1280,7 @@ async def pause(ctx):
 
 
 @bot.command(name='resume', aliases=['r'])
+@serialized
 async def resume(ctx):
     if ctx.voice_client and ctx.voice_client.is_paused():
         ctx.voice_client.resume()
@@ -795,26 +1290,31 @@ async def resume(ctx):
 
 
 @bot.command(name='stop')
+@serialized
 async def stop(ctx):
-    guild_id = ctx.guild.id
-    if guild_id in music_queues:
-        music_queues[guild_id].clear()
-    if guild_id in loop_mode:
-        loop_mode[guild_id] = 'off'
+    guild_player = get_player(ctx.guild.id)
+    cancel_prefetch(guild_player.guild_id)
+    guild_player.cancel_fills()
+    guild_player.queue.clear()
+    guild_player.loop_mode = 'off'
+    guild_player.changed()
     if ctx.voice_client:
         ctx.voice_client.stop()
         await ctx.send("⏹️ Stopped and cleared queue! Time for a break, senpai~ 💖")
-        await start_idle_timer(ctx)
+        idle_scheduler.arm(guild_player.guild_id, ctx)
 
 
 @bot.command(name='leave', aliases=['disconnect', 'dc'])
+@serialized
 async def leave(ctx):
     if ctx.voice_client:
-        guild_id = ctx.guild.id
-        if guild_id in music_queues:
-            music_queues[guild_id].clear()
-        if guild_id in loop_mode:
-            loop_mode[guild_id] = 'off'
+        guild_player = get_player(ctx.guild.id)
+        cancel_prefetch(guild_player.guild_id)
+        guild_player.cancel_fills()
+        guild_player.queue.clear()
+        guild_player.loop_mode = 'off'
+        guild_player.changed()
+        idle_scheduler.cancel(guild_player.guild_id)
         await ctx.voice_client.disconnect()
         await ctx.send("💖 Bye-bye, Come back soon~")
     else:
@@ -823,74 +1323,58 @@ async def leave(ctx):
 
 @bot.command(name='queue', aliases=['q'])
 async def queue(ctx):
-    guild_id = ctx.guild.id
-    embed = Embed(title="🎤 Miku's Playlist", color=0xff69b4)
-
-    if guild_id in now_playing:
-        player = now_playing[guild_id]
-        embed.add_field(name="Now Singing", value=player.title, inline=False)
-
-    if guild_id not in music_queues or len(music_queues[guild_id]) == 0:
-        embed.add_field(name="Queue", value="💔 Queue is empty, senpai~ Add some songs! 🎵", inline=False)
-    else:
-        queue_list = []
-        for i, player in enumerate(list(music_queues[guild_id])[:10], 1):
-            queue_list.append(f"{i}. {player.title}")
-        embed.add_field(name="Up Next", value="\n".join(queue_list), inline=False)
-        if len(music_queues[guild_id]) > 10:
-            embed.add_field(name="More", value=f"...and {len(music_queues[guild_id]) - 10} more tracks", inline=False)
-
-    loop_status = ""
-    if loop_mode.get(guild_id) == 'track':
-        loop_status = "🔂 Looping Track"
-    elif loop_mode.get(guild_id) == 'queue':
-        loop_status = "🔁 Looping Queue"
-    if loop_status:
-        embed.set_footer(text=loop_status)
-
-    await ctx.send(embed=embed)
+    guild_player = get_player(ctx.guild.id)
+    embed = render_page(guild_player, 0)
+    if page_count(guild_player) == 1:
+        await ctx.send(embed=embed)
+        return
+    view = QueueView(guild_player)
+    view.render()  # Sets the buttons' disabled state for page 1
+    view.message = await ctx.send(embed=embed, view=view)
 
 
 @bot.command(name='loop', aliases=['l'])
+@serialized
 async def loop_command(ctx, mode: str = None):
-    guild_id = ctx.guild.id
-
-    if guild_id not in loop_mode:
-        loop_mode[guild_id] = 'off'
+    guild_player = get_player(ctx.guild.id)
 
     if mode is None:
-        current = loop_mode[guild_id]
+        current = guild_player.loop_mode
         if current == 'off':
-            loop_mode[guild_id] = 'track'
+            guild_player.loop_mode = 'track'
             await ctx.send("🔂 **Loop:** Current track enabled! Let's sing it again~ 💖")
         elif current == 'track':
-            loop_mode[guild_id] = 'queue'
+            guild_player.loop_mode = 'queue'
             await ctx.send("🔁 **Loop:** Entire queue enabled! Non-stop music, senpai~ 🎤")
         else:
-            loop_mode[guild_id] = 'off'
+            guild_player.loop_mode = 'off'
             await ctx.send("❌ **Loop:** Disabled")
     else:
         mode = mode.lower()
         if mode in ['track', 't', 'song', 'single']:
-            loop_mode[guild_id] = 'track'
+            guild_player.loop_mode = 'track'
             await ctx.send("🔂 **Loop:** Current track enabled! Let's sing it again~ 💖")
         elif mode in ['queue', 'q', 'all']:
-            loop_mode[guild_id] = 'queue'
+            guild_player.loop_mode = 'queue'
             await ctx.send("🔁 **Loop:** Entire queue enabled! Non-stop music, senpai~ 🎤")
         elif mode in ['off', 'stop', 'disable']:
-            loop_mode[guild_id] = 'off'
+            guild_player.loop_mode = 'off'
             await ctx.send("❌ **Loop:** Disabled")
         else:
             await ctx.send(
                 "💔 Invalid mode, senpai~ Use: `!loop track`, `!loop queue`, or `!loop off` 💖"
             )
+            return
+
+    guild_player.changed()
+    refresh_prefetch(guild_player.guild_id)
 
 
 @bot.command(name='nowplaying', aliases=['np'])
 async def nowplaying(ctx):
-    guild_id = ctx.guild.id
-    if guild_id in now_playing:
-        player = now_playing[guild_id]
+    guild_player = get_player(ctx.guild.id)
+    if guild_player.current is not None:
+        player = guild_player.current
         embed = Embed(title="🎤 Now Singing", color=0xff69b4)
         embed.add_field(name="Title", value=player.title, inline=False)
         if player.duration:
@@ -900,9 +1384,9 @@ async def nowplaying(ctx):
         if player.thumbnail:
             embed.set_thumbnail(url=player.thumbnail)
         loop_status = ""
-        if loop_mode.get(guild_id) == 'track':
+        if guild_player.loop_mode == 'track':
             loop_status = "🔂 Looping Track"
-        elif loop_mode.get(guild_id) == 'queue':
+        elif guild_player.loop_mode == 'queue':
             loop_status = "🔁 Looping Queue"
         if loop_status:
             embed.set_footer(text=loop_status)
@@ -923,7 +1407,7 @@ async def commands(ctx):
         "**!stop** - Stop and clear queue\n"
         "**!leave** or **!dc** - Disconnect bot", inline=False)
     embed.add_field(name="Queue Management", value=
-        "**!queue** or **!q** - Show my playlist\n"
+        "**!queue** or **!q** - Show my playlist (page through it with the buttons)\n"
         "**!nowplaying** or **!np** - Show current song\n"
         "**!loop** or **!l** - Toggle loop (off → track → queue → off)\n"
         "**!loop track** - Loop current track\n"
@@ -933,7 +1417,10 @@ async def commands(ctx):
         "**!volume <0-100>** - Set volume\n"
         "**!shuffle** - Shuffle the queue\n"
         "**!remove <index>** - Remove a track from queue\n"
-        "**!ping** - Check bot latency", inline=False)
+        "**!move <from> <to>** or **!mv** - Move a track in the queue\n"
+        "**!playnext <song>** or **!pn** - Queue a song to play next\n"
+        "**!ping** - Check bot latency\n"
+        "**!stats** - Show playback stats", inline=False)
     embed.add_field(name="Supports", value=
         "✅ YouTube links & playlists\n"
         "✅ Spotify links, playlists & albums\n"
@@ -948,6 +1435,33 @@ async def ping(ctx):
     await ctx.send(embed=embed)
 
 @bot.command()
+async def stats(ctx):
+    guild_player = get_player(ctx.guild.id)
+    embed = Embed(title="📊 Miku's Stats", color=0xff69b4)
+    gaps = guild_player.gaps
+    if gaps:
+        embed.add_field(name="Song Gap", value=f"Last: {gaps[-1] * 1000:.0f}ms\nAvg: {sum(gaps) / len(gaps) * 1000:.0f}ms", inline=True)
+    else:
+        embed.add_field(name="Song Gap", value="No transitions yet", inline=True)
+    embed.add_field(name="Prefetching", value=f"{len(guild_player.prefetching)} tracks", inline=True)
+    source = ctx.voice_client.source if ctx.voice_client else None
+    if isinstance(source, TrackAudio):
+        embed.add_field(name="Playback", value="Opus passthrough" if source.passthrough else "Re-encoding", inline=True)
+    embed.add_field(name="Search Cache", value=f"{search_cache.hit_rate() * 100:.0f}% hits ({search_cache.hits}/{search_cache.hits + search_cache.misses})", inline=True)
+    embed.add_field(name="Extraction", value=f"{ytdl_extractor.in_flight} running, {ytdl_extractor.queued()} queued", inline=True)
+    embed.add_field(name="Stream Cache", value=f"{len(stream_cache)} streams, {stream_cache.hits} reused ({stream_cache.shared_hits} shared)", inline=True)
+    embed.add_field(name="Idle Timers", value=f"{len(idle_scheduler)} pending", inline=True)
+    if loop_monitor is not None:
+        stall = f"\nLast stall: {loop_monitor.last_stall[1]}" if loop_monitor.last_stall else ""
+        embed.add_field(name="Event Loop", value=f"Lag: {loop_monitor.last_lag * 1000:.0f}ms (p99 {loop_monitor.percentile(0.99) * 1000:.0f}ms, max {loop_monitor.max_lag * 1000:.0f}ms)\n{loop_monitor.stalls} stalls{stall}", inline=False)
+    on_disk = conversations.on_disk()
+    embed.add_field(name="Conversations", value=f"{len(conversations)} in memory (~{conversations.tokens / 1000:.1f}k tokens), {'?' if on_disk is None else on_disk} on disk", inline=True)
+    if SHARD_COUNT:
+        embed.add_field(name="Cluster", value=f"Cluster {CLUSTER_ID}, shard {ctx.guild.shard_id} of {SHARD_COUNT} (running {len(bot.shards)})", inline=True)
+    await ctx.send(embed=embed)
+
+@bot.command()
+@serialized
 async def volume(ctx, volume: int):
     if not ctx.voice_client:
         embed = Embed(title="💔 Error", description="I'm not in a voice channel, senpai~ 😢", color=0xff69b4)
@@ -957,37 +1471,286 @@ async def volume(ctx, volume: int):
         embed = Embed(title="💔 Error", description="Volume must be between 0 and 100, senpai! 💖", color=0xff69b4)
         await ctx.send(embed=embed)
         return
-    ctx.voice_client.source.volume = volume / 100
+    guild_player = get_player(ctx.guild.id)
+    guild_player.volume = volume / 100
+    guild_player.changed()
+    source = ctx.voice_client.source
+    if isinstance(source, YTDLOpusSource):
+        # Opus volume lives in the ffmpeg command, so restart the stream where it is
+        replacement = await load_source(source.track, volume=volume / 100, start=source.position)
+        if ctx.voice_client and ctx.voice_client.source is source:
+            ctx.voice_client.source = replacement
+            guild_player.current = replacement
+            source.cleanup()
+        else:
+            replacement.cleanup()
+    elif source is not None:
+        source.volume = volume / 100
     embed = Embed(title="🔊 Volume Set", description=f"Volume set to {volume}%", color=0xff69b4)
     await ctx.send(embed=embed)
 
 @bot.command()
+@serialized
 async def shuffle(ctx):
-    guild_id = ctx.guild.id
-    if guild_id not in music_queues or len(music_queues[guild_id]) < 2:
+    guild_player = get_player(ctx.guild.id)
+    if len(guild_player.queue) < 2:
         embed = Embed(title="💔 Error", description="Not enough tracks in queue to shuffle, senpai~ Add more songs! 🎵", color=0xff69b4)
         await ctx.send(embed=embed)
         return
-    random.shuffle(music_queues[guild_id])
+    guild_player.queue.shuffle()
+    guild_player.changed()
+    refresh_prefetch(guild_player.guild_id)
     embed = Embed(title="🔀 Shuffled!", description="The queue has been shuffled! Let's mix it up~ 💖", color=0xff69b4)
     await ctx.send(embed=embed)
 
 @bot.command()
+@serialized
 async def remove(ctx, index: int):
-    guild_id = ctx.guild.id
-    if guild_id not in music_queues or len(music_queues[guild_id]) == 0:
+    guild_player = get_player(ctx.guild.id)
+    if len(guild_player.queue) == 0:
         embed = Embed(title="💔 Error", description="Queue is empty, senpai~ 😢", color=0xff69b4)
         await ctx.send(embed=embed)
         return
-    if index < 1 or index > len(music_queues[guild_id]):
+    if index < 1 or index > len(guild_player.queue):
         embed = Embed(title="💔 Error", description="Invalid index, senpai! 💖", color=0xff69b4)
         await ctx.send(embed=embed)
         return
-    removed = music_queues[guild_id][index - 1]
-    del music_queues[guild_id][index - 1]
+    removed = guild_player.queue.pop(index - 1)
+    guild_player.changed()
+    refresh_prefetch(guild_player.guild_id)
     embed = Embed(title="🗑️ Removed", description=f"Removed: {removed.title}", color=0xff69b4)
     await ctx.send(embed=embed)
 
+@bot.command(name='move', aliases=['mv'])
+@serialized
+async def move(ctx, source: int, destination: int):
+    guild_player = get_player(ctx.guild.id)
+    size = len(guild_player.queue)
+    if not (1 <= source <= size and 1 <= destination <= size):
+        embed = Embed(title="💔 Error", description="Invalid index, senpai! 💖", color=0xff69b4)
+        await ctx.send(embed=embed)
+        return
+    moved = guild_player.queue.move(source - 1, destination - 1)
+    guild_player.changed()
+    refresh_prefetch(guild_player.guild_id)
+    embed = Embed(title="↕️ Moved", description=f"**{moved.title}** is now #{destination} in the queue~ 💖", color=0xff69b4)
+    await ctx.send(embed=embed)
+
+@bot.command(name='playnext', aliases=['pn'])
+@serialized
+async def playnext(ctx, *, query):
+    if not ctx.author.voice:
+        await ctx.send("💢 Join a voice channel first, baka! I can't sing without you~ 🎤")
+        return
+    if "spotify.com" in query or "youtube.com/playlist" in query or "&list=" in query:
+        await ctx.send("💔 One song at a time for !playnext, senpai~ Use !play for playlists! 🎵")
+        return
+
+    if not ctx.voice_client:
+        await ctx.author.voice.channel.connect()
+    guild_player = get_player(ctx.guild.id)
+    guild_player.text_channel_id = ctx.channel.id
+    async with ctx.typing():
+        try:
+            if query.startswith('http'):
+                track = Track.from_data(await YTDLSource.extract(query), query)
+            else:
+                track = await search_track(f"ytsearch:{query}")
+        except Exception as e:
+            await ctx.send(f"💔 Oopsie~ Something went wrong, senpai! {e}")
+            return
+        guild_player.queue.insert(0, track)
+        guild_player.changed()
+        embed = Embed(title="⏭️ Playing Next", description=f"**{track.title}**", color=0xff69b4)
+        await ctx.send(embed=embed)
+        if not ctx.voice_client.is_playing():
+            await start_next(ctx)
+        else:
+            refresh_prefetch(guild_player.guild_id)
+
+def snapshot_queues():
+    """Hand every guild whose playback state moved to the queue store (written on its own thread)"""
+    if bot.is_closed():
+        return  # Shutting down: voice is being disconnected, keep the last snapshots as they are
+    for guild_id, guild_player in list(players.items()):
+        guild = bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        if voice_client is None or (guild_player.current is None and not guild_player.queue):
+            if guild_id in queue_store.saved_versions:
+                queue_store.delete(guild_id)
+            continue
+        queue_changed = queue_store.saved_versions.get(guild_id) != guild_player.version
+        current = guild_player.current
+        if not queue_changed and current is None:
+            continue
+        state = {
+            'voice_channel_id': voice_client.channel.id,
+            'text_channel_id': guild_player.text_channel_id,
+            'loop_mode': guild_player.loop_mode,
+            'volume': guild_player.volume,
+            'current': current.track.descriptor() if current is not None else None,
+            'position': current.position if current is not None else 0,
+        }
+        tracks = None
+        if queue_changed:
+            # When looping the queue the current track was already requeued at the tail;
+            # restoring puts it back up front, so saving that copy too would duplicate it on every restart
+            requeued = current.track if current is not None and guild_player.loop_mode == 'queue' else None
+            tracks = [track.descriptor() for track in guild_player.queue if track is not requeued]
+        queue_store.save(guild_id, guild_player.version, state, tracks)
+
+
+async def snapshot_loop():
+    while True:
+        await asyncio.sleep(QUEUE_SNAPSHOT_INTERVAL)
+        try:
+            snapshot_queues()
+        except Exception as e:
+            print(f"Queue snapshot error: {e}")
+
+
+async def restore_queues():
+    """Resume the guilds that were playing before the restart, one at a time in the background"""
+    for saved in await asyncio.to_thread(queue_store.load):
+        if not handles_guild(saved['guild_id']):
+            continue  # In cluster mode QUEUE_DB is shared; another process restores this one
+        try:
+            await restore_guild(saved)
+        except Exception as e:
+            print(f"Couldn't restore the queue for guild {saved['guild_id']}: {e}")
+            queue_store.delete(saved['guild_id'])
+
+
+async def restore_guild(saved):
+    guild = bot.get_guild(saved['guild_id'])
+    channel = guild.get_channel(saved['voice_channel_id']) if guild else None
+    if channel is None or not any(not member.bot for member in channel.members):
+        queue_store.delete(saved['guild_id'])  # Nobody left to listen
+        return
+
+    guild_player = get_player(guild.id)
+    async with guild_player.lock:
+        if guild.voice_client or guild_player.current is not None or guild_player.queue:
+            return  # Someone already started something new
+        # Only descriptors go back in the queue; each track is resolved when it comes up, as usual
+        tracks = [Track.from_descriptor(descriptor) for descriptor in saved['tracks']]
+        if saved['current']:
+            tracks.insert(0, Track.from_descriptor(saved['current']))
+            guild_player.resume_at = saved['position']
+        guild_player.queue.extend(tracks)
+        guild_player.loop_mode = saved['loop_mode']
+        guild_player.volume = saved['volume']
+        guild_player.text_channel_id = saved['text_channel_id']
+        guild_player.changed()
+
+        text_channel = guild.get_channel(saved['text_channel_id']) if saved['text_channel_id'] else None
+        ctx = ResumeCtx(guild, text_channel or channel)
+        await channel.connect()
+        await ctx.send("💖 I'm back, senpai~ Picking up right where we left off! 🎤")
+        await start_next(ctx)
+
+
+def live_ffmpeg_processes():
+    """ffmpeg children of this process, from /proc so leaked ones count too (sampled off the event loop)"""
+    count = 0
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        name, _, rest = stat[stat.index('(') + 1:].partition(') ')
+        if name == 'ffmpeg' and int(rest.split()[1]) == os.getpid():
+            count += 1
+    return count
+
+
+def voice_ffmpeg_processes():
+    """Without /proc: the ffmpeg processes behind the voice clients' current sources"""
+    count = 0
+    for voice_client in bot.voice_clients:
+        source = getattr(voice_client.source, 'original', voice_client.source)
+        process = getattr(source, '_process', None)
+        if process is not None and process.poll() is None:
+            count += 1
+    return count
+
+
+def active_players():
+    # Only guilds with something going on, so idle guilds don't add label series
+    return [p for p in players.values() if p.current is not None or p.queue]
+
+
+metrics.gauge('miku_gateway_latency_seconds', "Discord gateway heartbeat latency", lambda: bot.latency)
+metrics.gauge('miku_voice_connections', "Connected voice clients", lambda: len(bot.voice_clients))
+if os.path.isdir('/proc'):
+    metrics.gauge('miku_ffmpeg_processes', "Live ffmpeg child processes", live_ffmpeg_processes, off_loop=True)
+else:
+    metrics.gauge('miku_ffmpeg_processes', "Live ffmpeg child processes", voice_ffmpeg_processes)
+metrics.gauge('miku_playing_guilds', "Guilds with a track playing", lambda: sum(p.current is not None for p in players.values()))
+metrics.gauge('miku_queued_tracks', "Tracks waiting in all queues", lambda: sum(len(p.queue) for p in players.values()))
+metrics.gauge('miku_guild_queue_depth', "Tracks waiting in a guild's queue",
+              lambda: {(('guild', p.guild_id),): len(p.queue) for p in active_players()})
+metrics.gauge('miku_guild_track_gap_seconds', "Silence between a guild's last two tracks",
+              lambda: {(('guild', p.guild_id),): p.gaps[-1] for p in active_players() if p.gaps})
+metrics.gauge('miku_search_cache_hits_total', "Search cache hits", lambda: search_cache.hits, kind='counter')
+metrics.gauge('miku_search_cache_misses_total', "Search cache misses", lambda: search_cache.misses, kind='counter')
+metrics.gauge('miku_search_cache_hit_ratio', "Search cache hits / lookups since start", search_cache.hit_rate)
+metrics.gauge('miku_extractions', "yt-dlp extractions by state",
+              lambda: {(('state', 'running'),): ytdl_extractor.in_flight, (('state', 'queued'),): ytdl_extractor.queued()})
+metrics.gauge('miku_stream_cache_entries', "Resolved streams cached", lambda: len(stream_cache))
+metrics.gauge('miku_stream_cache_shared_hits_total', "Streams reused from the shared STREAM_CACHE_PATH file",
+              lambda: stream_cache.shared_hits, kind='counter')
+metrics.gauge('miku_conversations', "Conversations held in memory", lambda: len(conversations))
+if loop_monitor is not None:
+    metrics.gauge('miku_loop_lag_seconds', "Event loop lag by statistic over the last minute",
+                  lambda: {(('stat', 'last'),): loop_monitor.last_lag, (('stat', 'p99'),): loop_monitor.percentile(0.99),
+                           (('stat', 'max'),): loop_monitor.max_lag})
+    metrics.gauge('miku_loop_stalls_total', "Times the loop was blocked past LOOP_STALL_MS", lambda: loop_monitor.stalls, kind='counter')
+metrics.gauge('miku_idle_timers', "Pending idle-disconnect deadlines", lambda: len(idle_scheduler))
+if SHARD_COUNT:
+    metrics.gauge('miku_shard_latency_seconds', "Gateway heartbeat latency per shard",
+                  lambda: {(('shard', shard_id),): latency for shard_id, latency in bot.latencies})
+
+
+def bot_health():
+    """/health: cluster.py polls this to tell a live process from a stuck or disconnected one"""
+    return {
+        'ready': bot.is_ready() and not bot.is_closed(),
+        'cluster': CLUSTER_ID,
+        'shards': SHARD_IDS or list(range(SHARD_COUNT or 1)),
+        'guilds': len(bot.guilds),
+        'voice_connections': len(bot.voice_clients),
+        'playing': sum(p.current is not None for p in players.values()),
+        'queued': sum(len(p.queue) for p in players.values()),
+        'latency': bot.latency,
+        'loop_lag': loop_monitor.last_lag if loop_monitor is not None else None,
+        'extractions': ytdl_extractor.in_flight + ytdl_extractor.queued(),
+    }
+
+
 # Get token from Replit Secrets
 token = os.getenv('DISCORD_TOKEN')
-bot.run("DISCORD_TOKEN")
+def shutdown(signum, frame):
+    # Snapshot before bot.close() disconnects voice (deploys send SIGTERM)
+    if queue_store is not None:
+        snapshot_queues()
+    raise KeyboardInterrupt
+
+
+if __name__ == '__main__':
+    if os.getenv('KEEP_ALIVE', '1') != '0':
+        # Web server with /, /health and /metrics (cluster.py gives each process its own local port)
+        keep_alive(host=os.getenv('KEEP_ALIVE_HOST', '0.0.0.0'), port=int(os.getenv('KEEP_ALIVE_PORT', '8080')),
+                   health=functools.partial(metrics.on_loop, bot_health))
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    try:
+        bot.run(token)
+    finally:
+        conversations.close()
+        search_cache.close()
+        stream_cache.close()
+        if queue_store is not None:
+            queue_store.close()
+
@@ -0,0 +1,101 @@
+import bisect
+import re
+import unicodedata
+
+_separators = re.compile(r'[\W_]+')
+
+MAX_NAME_WORDS = 4  # Longest name (in words) looked for in a message
+MIN_PREFIX = 3  # Shortest first word that may match the start of a longer name...
+# ...and cover at least half of the name's first word ("rob" -> "robert smith", but not "the" -> "theodore")
+PREFIX_SCAN = 64  # Names looked at per prefix search before calling it ambiguous
+
+
+def normalize(text):
+    """Case-, width- and punctuation-insensitive form of a name or message ("Bób_the.Builder" -> "bób the builder")"""
+    if not text.isascii():
+        text = unicodedata.normalize('NFKC', text)
+    return _separators.sub(' ', text.casefold()).strip()
+
+
+def names_of(member):
+    """Every name someone might call a member by: username, global display name, server nickname"""
+    names = {normalize(name) for name in (member.name, getattr(member, 'global_name', None),
+                                          getattr(member, 'nick', None) or member.display_name) if name}
+    names.discard('')
+    return names
+
+
+class MemberIndex:
+    """One guild's normalized member names -> member IDs, for finding who a chat message means.
+
+    Exact names are a dict lookup; prefixes use a sorted list of names and
+    bisect. Both take microseconds however big the guild is, unlike scanning
+    guild.members. Member join/leave/update events keep it current.
+    """
+
+    def __init__(self, members=()):
+        self._ids = {}  # name -> set of member IDs with that name
+        self._names = []  # sorted distinct names, for prefix search
+        self._by_member = {}  # member ID -> its names, to undo them on leave/rename
+        for member in members:
+            self._by_member[member.id] = names_of(member)
+        for member_id, names in self._by_member.items():
+            for name in names:
+                self._ids.setdefault(name, set()).add(member_id)
+        self._names = sorted(self._ids)
+
+    def __len__(self):
+        return len(self._by_member)
+
+    def add(self, member):
+        self.remove(member.id)
+        names = self._by_member[member.id] = names_of(member)
+        for name in names:
+            ids = self._ids.get(name)
+            if ids is None:
+                ids = self._ids[name] = set()
+                bisect.insort(self._names, name)
+            ids.add(member.id)
+
+    def remove(self, member_id):
+        for name in self._by_member.pop(member_id, ()):
+            ids = self._ids[name]
+            ids.discard(member_id)
+            if not ids:
+                del self._ids[name]
+                del self._names[bisect.bisect_left(self._names, name)]
+
+    def find(self, text):
+        """The one member a message names, or None when nobody or more than one person fits.
+
+        The name has to start the text, so "jake is so annoying" never means a member
+        called "annoying": the longest whole name there (up to MAX_NAME_WORDS words),
+        else a unique name starting with the first word ("rob" -> "robert").
+        Ambiguous matches return None rather than guessing.
+        """
+        words = normalize(text).split()
+        for end in range(min(len(words), MAX_NAME_WORDS), 0, -1):
+            ids = self._ids.get(words[0] if end == 1 else ' '.join(words[:end]))
+            if ids:
+                return next(iter(ids)) if len(ids) == 1 else None
+        if words and len(words[0]) >= MIN_PREFIX:
+            return self._unique_prefix(words[0])
+        return None
+
+    def _unique_prefix(self, prefix):
+        found = None
+        start = bisect.bisect_left(self._names, prefix)
+        for i in range(start, min(start + PREFIX_SCAN, len(self._names))):
+            name = self._names[i]
+            if not name.startswith(prefix):
+                break
+            if len(prefix) * 2 < len(name.split(' ', 1)[0]):
+                continue
+            for member_id in self._ids[name]:
+                if found is not None and member_id != found:
+                    return None  # Several people start with this
+                found = member_id
+        else:
+            if start + PREFIX_SCAN < len(self._names) and self._names[start + PREFIX_SCAN].startswith(prefix):
+                return None  # Too common a prefix to mean anyone in particular
+        return found
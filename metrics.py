@@ -0,0 +1,169 @@
+import asyncio
+import contextlib
+import functools
+import math
+import threading
+import time
+
+# Prometheus text exposition format, without the client library.
+# Counters and histograms are updated where things happen (any thread);
+# gauges are sampled from the bot's event loop (or the scraping thread) when /metrics is scraped.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics = []
+_gauges = []
+_loop = None
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_labels(key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in self._values.items():
+                for bound, count in zip(self.buckets + (math.inf,), entry[:len(self.buckets)] + [entry[-1]]):
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', _number(bound)),))} {count}")
+                lines.append(f"{self.name}_sum{_labels(key)} {_number(entry[-2])}")
+                lines.append(f"{self.name}_count{_labels(key)} {entry[-1]}")
+        return lines
+
+
+@contextlib.contextmanager
+def timed(histogram, **labels):
+    """Observe how long the block took, labelled with result ok, error or cancelled"""
+    start = time.monotonic()
+    result = 'error'
+    try:
+        yield
+        result = 'ok'
+    except asyncio.CancelledError:
+        result = 'cancelled'
+        raise
+    finally:
+        histogram.observe(time.monotonic() - start, result=result, **labels)
+
+
+def gauge(name, help_text, sample, kind='gauge', *, off_loop=False):
+    """Register a gauge read at scrape time; sample() returns a number or {(('label', value), ...): number}.
+
+    Samplers run on the bot's event loop unless off_loop=True, which runs them on the
+    scraping thread instead: for ones that do blocking I/O and touch no bot state.
+    """
+    _gauges.append((name, help_text, sample, kind, off_loop))
+
+
+def _sample(off_loop):
+    values = {}
+    for name, _, sample, _, sampled_off_loop in _gauges:
+        if sampled_off_loop == off_loop:
+            try:
+                values[name] = sample()
+            except Exception:
+                pass  # One broken sampler shouldn't take the whole endpoint down
+    return values
+
+
+def _render_gauges(samples):
+    lines = []
+    for name, help_text, _, kind, _ in _gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if name not in samples:
+            continue
+        values = samples[name]
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            lines.append(f"{name}{_labels(key)} {_number(value)}")
+    return lines
+
+
+async def _call(fn):
+    return fn()
+
+
+def set_loop(loop):
+    """Sample gauges on this event loop (bot state is only touched from there)"""
+    global _loop
+    _loop = loop
+
+
+def on_loop(fn):
+    """Call fn() on the bot's loop and return its result (inline if the loop isn't running); for other threads"""
+    if _loop is not None and _loop.is_running():
+        return asyncio.run_coroutine_threadsafe(_call(fn), _loop).result(timeout=5)
+    return fn()
+
+
+def render():
+    """The full /metrics page; safe to call from the web server's thread"""
+    samples = on_loop(functools.partial(_sample, False))
+    samples.update(_sample(True))
+    lines = _render_gauges(samples)
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# Shared by the modules that do the work
+extract_seconds = Histogram('miku_extract_seconds', "Time to resolve a track, search or Spotify link, by backend")
+gemini_seconds = Histogram('miku_gemini_seconds', "Gemini request time (until the last chunk when streaming)")
+gemini_errors = Counter('miku_gemini_errors_total', "Failed Gemini requests by reason")
@@ -0,0 +1,102 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+
+class QueueStore:
+    """Per-guild queue snapshots in SQLite so queues survive restarts.
+
+    Writes go through a queue to one writer thread, so the event loop never
+    waits on disk. Playback state (current track, position, loop mode,
+    volume, channels) and the queued tracks are separate rows. The position
+    changes every few seconds and only needs a one-row update; the track list
+    is rewritten only when the queue changed.
+    """
+
+    def __init__(self, path='queues.db', *, max_age=6 * 3600):
+        self.path = path
+        self.max_age = max_age  # Snapshots older than this are too stale to resume
+        self.saved_versions = {}  # guild_id -> GuildPlayer.version last written
+        self._writes = queue.SimpleQueue()
+        db = self._connect()
+        db.execute('''CREATE TABLE IF NOT EXISTS guild_state (
+            guild_id INTEGER PRIMARY KEY,
+            voice_channel_id INTEGER NOT NULL,
+            text_channel_id INTEGER,
+            loop_mode TEXT NOT NULL,
+            volume REAL NOT NULL,
+            current TEXT,
+            position REAL NOT NULL,
+            saved REAL NOT NULL)''')
+        db.execute('''CREATE TABLE IF NOT EXISTS guild_queue (
+            guild_id INTEGER PRIMARY KEY,
+            tracks TEXT NOT NULL)''')
+        db.close()
+        self._writer = threading.Thread(target=self._write_loop, name='queue-store', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def load(self):
+        """Saved guilds as dicts (current/tracks are track descriptors), skipping stale ones"""
+        db = self._connect()
+        try:
+            rows = db.execute('''SELECT s.guild_id, voice_channel_id, text_channel_id, loop_mode, volume,
+                                        current, position, saved, q.tracks
+                                 FROM guild_state s LEFT JOIN guild_queue q ON q.guild_id = s.guild_id
+                                 WHERE saved > ?''', (time.time() - self.max_age,)).fetchall()
+        finally:
+            db.close()
+        return [{
+            'guild_id': guild_id,
+            'voice_channel_id': voice_channel_id,
+            'text_channel_id': text_channel_id,
+            'loop_mode': loop_mode,
+            'volume': volume,
+            'current': json.loads(current) if current else None,
+            'position': position,
+            'tracks': json.loads(tracks) if tracks else [],
+        } for guild_id, voice_channel_id, text_channel_id, loop_mode, volume, current, position, saved, tracks in rows]
+
+    def save(self, guild_id, version, state, tracks=None):
+        """Queue a snapshot write; tracks=None keeps the stored track list (only the state changed)"""
+        self._writes.put(('save', guild_id, state, tracks))
+        self.saved_versions[guild_id] = version
+
+    def delete(self, guild_id):
+        self._writes.put(('delete', guild_id, None, None))
+        self.saved_versions.pop(guild_id, None)
+
+    def close(self):
+        """Finish pending writes"""
+        self._writes.put(None)
+        self._writer.join(timeout=10)
+
+    def _write_loop(self):
+        db = self._connect()
+        while (item := self._writes.get()) is not None:
+            op, guild_id, state, tracks = item
+            try:
+                if op == 'delete':
+                    db.execute('DELETE FROM guild_state WHERE guild_id = ?', (guild_id,))
+                    db.execute('DELETE FROM guild_queue WHERE guild_id = ?', (guild_id,))
+                    continue
+                db.execute('BEGIN')
+                db.execute('INSERT OR REPLACE INTO guild_state VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (guild_id, state['voice_channel_id'], state['text_channel_id'], state['loop_mode'],
+                            state['volume'], json.dumps(state['current']) if state['current'] else None,
+                            state['position'], time.time()))
+                if tracks is not None:
+                    db.execute('INSERT OR REPLACE INTO guild_queue VALUES (?, ?)', (guild_id, json.dumps(tracks)))
+                db.execute('COMMIT')
+            except Exception as e:
+                print(f"Queue snapshot error: {e}")
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+        db.close()
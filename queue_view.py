@@ -0,0 +1,136 @@
+import math
+
+import discord
+from discord import Embed
+
+PAGE_SIZE = 10
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class PageCache:
+    """Rendered !queue pages for one guild, valid while GuildPlayer.version doesn't change"""
+
+    __slots__ = ('version', 'pages', 'duration')
+
+    def __init__(self, version):
+        self.version = version
+        self.pages = {}  # page number -> "Up Next" text
+        self.duration = None  # TrackQueue.duration() at this version
+
+
+def page_count(guild_player):
+    return max(1, math.ceil(len(guild_player.queue) / PAGE_SIZE))
+
+
+def render_page(guild_player, page):
+    """The !queue embed for a page (0-based). Only that page's tracks are sliced and formatted,
+    once per queue version; the "now singing" line and time left are cheap and always fresh."""
+    cache = guild_player.pages
+    if cache is None or cache.version != guild_player.version:
+        cache = guild_player.pages = PageCache(guild_player.version)
+    body = cache.pages.get(page)
+    if body is None:
+        start = page * PAGE_SIZE
+        lines = []
+        for i, track in enumerate(guild_player.queue.slice(start, start + PAGE_SIZE), start + 1):
+            length = f" `{format_duration(track.duration)}`" if track.duration else ""
+            lines.append(f"{i}. {track.title}{length}")
+        body = cache.pages[page] = "\n".join(lines)
+    if cache.duration is None:
+        cache.duration = guild_player.queue.duration()
+
+    embed = Embed(title="🎤 Miku's Playlist", color=0xff69b4)
+    remaining, unknown = cache.duration
+    current = guild_player.current
+    if current is not None:
+        progress = ""
+        if current.duration:
+            progress = f" `{format_duration(current.position)}/{format_duration(current.duration)}`"
+            remaining += max(0, current.duration - current.position)
+        embed.add_field(name="Now Singing", value=f"{current.title}{progress}", inline=False)
+
+    if not guild_player.queue:
+        embed.add_field(name="Queue", value="💔 Queue is empty, senpai~ Add some songs! 🎵", inline=False)
+    else:
+        embed.add_field(name="Up Next", value=body, inline=False)
+
+    footer = [f"Page {page + 1}/{page_count(guild_player)}", f"{len(guild_player.queue)} tracks",
+              f"{format_duration(remaining)} left" + (f" (+{unknown} of unknown length)" if unknown else "")]
+    if guild_player.loop_mode == 'track':
+        footer.append("🔂 Looping Track")
+    elif guild_player.loop_mode == 'queue':
+        footer.append("🔁 Looping Queue")
+    embed.set_footer(text=" • ".join(footer))
+    return embed
+
+
+class QueueView(discord.ui.View):
+    """First/previous/next/last buttons and a jump-to-page dialog under a !queue message"""
+
+    def __init__(self, guild_player, *, timeout=180):
+        super().__init__(timeout=timeout)
+        self.guild_player = guild_player
+        self.page = 0
+        self.message = None  # Set by whoever sends it, so the buttons can be disabled on timeout
+
+    def render(self):
+        pages = page_count(self.guild_player)
+        self.page = max(0, min(self.page, pages - 1))  # The queue may have shrunk since the last click
+        self.first_page.disabled = self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.last_page.disabled = self.page == pages - 1
+        self.jump.disabled = pages == 1
+        return render_page(self.guild_player, self.page)
+
+    async def show(self, interaction, page):
+        self.page = page
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(emoji="⏮️", style=discord.ButtonStyle.secondary)
+    async def first_page(self, interaction, button):
+        await self.show(interaction, 0)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.primary)
+    async def previous_page(self, interaction, button):
+        await self.show(interaction, self.page - 1)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction, button):
+        await self.show(interaction, self.page + 1)
+
+    @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.secondary)
+    async def last_page(self, interaction, button):
+        await self.show(interaction, page_count(self.guild_player) - 1)
+
+    @discord.ui.button(label="Jump", emoji="🔢", style=discord.ButtonStyle.secondary)
+    async def jump(self, interaction, button):
+        await interaction.response.send_modal(JumpModal(self))
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass  # Deleted meanwhile
+
+
+class JumpModal(discord.ui.Modal, title="Jump to page"):
+    page = discord.ui.TextInput(label="Page", placeholder="1", max_length=6)
+
+    def __init__(self, queue_view):
+        super().__init__()
+        self.queue_view = queue_view
+
+    async def on_submit(self, interaction):
+        try:
+            page = int(self.page.value) - 1
+        except ValueError:
+            page = self.queue_view.page
+        await self.queue_view.show(interaction, page)
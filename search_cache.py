@@ -0,0 +1,102 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from sqlite_writer import READ_TIMEOUT, SQLiteWriter, connect, shared_path
+
+_whitespace = re.compile(r'\s+')
+
+
+class SearchCache:
+    """On-disk cache of ytsearch queries -> resolved video ID + display metadata (TTL + LRU bounded)
+
+    Lookups read on the caller's thread and give up on a lock after READ_TIMEOUT;
+    inserts, last-used updates and eviction go to a writer thread. Any sqlite
+    error on a lookup is a miss, so a busy file only ever costs a search.
+    """
+
+    def __init__(self, path='search_cache.db', *, ttl=7 * 24 * 3600, max_entries=50000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        path = shared_path(path, f'search_cache_{id(self)}')
+        self._db = connect(path)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS searches (
+            query TEXT PRIMARY KEY,
+            video_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used)')
+        self._db.execute(f'PRAGMA busy_timeout = {int(READ_TIMEOUT * 1000)}')
+        self._writer = SQLiteWriter(path, name='search-cache')
+
+    @staticmethod
+    def normalize(query):
+        query = query.strip()
+        if query.lower().startswith('ytsearch:'):
+            query = query[len('ytsearch:'):]
+        return _whitespace.sub(' ', query).strip().lower()
+
+    def get(self, query):
+        """Return cached metadata for a search query, or None if missing/expired"""
+        key = self.normalize(query)
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._db.execute('SELECT data, created FROM searches WHERE query = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Search cache read error: {e}")
+            row = None
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                self._writer.execute('DELETE FROM searches WHERE query = ?', (key,))
+            self.misses += 1
+            return None
+        self._writer.execute('UPDATE searches SET last_used = ? WHERE query = ?', (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query, data):
+        """Remember which video a search query resolved to (only the stable metadata, never stream URLs)"""
+        video_id = data.get('id')
+        if not video_id:
+            return
+        entry = {
+            'id': video_id,
+            'webpage_url': data.get('webpage_url') or f"https://www.youtube.com/watch?v={video_id}",
+            'title': data.get('title'),
+            'duration': data.get('duration'),
+            'thumbnail': data.get('thumbnail'),
+        }
+        now = time.time()
+        self._writer.execute('INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?)',
+                             (self.normalize(query), video_id, json.dumps(entry), now, now))
+        self._puts += 1
+        if self._puts % 100 == 0:
+            self._writer.call(lambda db: self._evict(db, now))
+
+    def clear(self):
+        """Forget every search (the benchmarks make each run pay for its searches)"""
+        self._writer.execute('DELETE FROM searches')
+        self._writer.flush()
+
+    def close(self):
+        """Finish pending writes"""
+        self._writer.close()
+
+    def _evict(self, db, now):
+        db.execute('DELETE FROM searches WHERE created < ?', (now - self.ttl,))
+        excess = db.execute('SELECT COUNT(*) FROM searches').fetchone()[0] - self.max_entries
+        if excess > 0:
+            db.execute('DELETE FROM searches WHERE query IN '
+                       '(SELECT query FROM searches ORDER BY last_used LIMIT ?)', (excess,))
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -1,32 +1,192 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from youtubesearchpython import VideosSearch
+import asyncio
+import codecs
+import html
 import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-    client_id=os.getenv("SPOTIFY_CLIENT_ID"),
-    client_secret=os.getenv("SPOTIFY_CLIENT_SECRET")))
+import aiohttp
 
+import metrics
 
-def get_youtube_urls_from_spotify(sp_url):
-    urls = []
-    try:
-        if "playlist" in sp_url:
-            playlist = sp.playlist_tracks(sp_url)
-            for item in playlist['items']:
-                track = item['track']
-                query = f"{track['name']} {track['artists'][0]['name']}"
-                yt = VideosSearch(query, limit=1).result()
-                if yt["result"]:
-                    urls.append(yt["result"][0]["link"])
-
-        elif "track" in sp_url:
-            track = sp.track(sp_url)
-            query = f"{track['name']} {track['artists'][0]['name']}"
-            yt = VideosSearch(query, limit=1).result()
-            if yt["result"]:
-                urls.append(yt["result"][0]["link"])
+# Optional Spotify support
+try:
+    import spotipy  # type: ignore
+    from spotipy.cache_handler import MemoryCacheHandler  # type: ignore
+    from spotipy.oauth2 import SpotifyClientCredentials  # type: ignore
+except ImportError:
+    spotipy = None
+    SpotifyClientCredentials = None
+
+PLAYLIST_PAGE_SIZE = 100
+ALBUM_PAGE_SIZE = 50
+
+# Page scraping fallback (no API credentials)
+SCRAPE_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+SCRAPE_MAX_BYTES = 256 * 1024  # Metadata lives in <head>; never read further than this
+TITLE_CACHE_SIZE = 4096
+
+_meta_tag = re.compile(r'<meta\s+(?:property|name)="(og:title|og:description|twitter:title|twitter:description)"\s+content="([^"]*)"', re.IGNORECASE)
+_title_tag = re.compile(r'<title>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+_title_prefix = re.compile(r'^(Listen to|Song:|Track:)', re.IGNORECASE)
+_title_suffix = re.compile(r'\s*(-\s*song.*|on Spotify|by .*)$', re.IGNORECASE)
+_legacy_artist = re.compile(r'\bby (.*)$')
+_track_id = re.compile(r'/track/([a-zA-Z0-9]+)')
+
+_session = None
+_titles = OrderedDict()  # track ID -> search term
+
+
+def track_query(track):
+    """"Song Artist" search query for a Spotify track object"""
+    name = track.get('name')
+    artist = track.get('artists')[0].get('name') if track.get('artists') else ''
+    return f"{name} {artist}"
+
+
+class SpotifyResolver:
+    """Shared Spotify API client: token reused across calls, requests run off the event loop"""
+
+    def __init__(self, client_id=None, client_secret=None, *, page_concurrency=4):
+        self.client_id = client_id or os.getenv("SPOTIFY_CLIENT_ID")
+        self.client_secret = client_secret or os.getenv("SPOTIFY_CLIENT_SECRET")
+        self._sp = None
+        self._pool = ThreadPoolExecutor(max_workers=page_concurrency, thread_name_prefix='spotify')
+
+    @property
+    def available(self):
+        return bool(spotipy and self.client_id and self.client_secret)
+
+    def _client(self):
+        if self._sp is None:
+            # One auth manager for the whole bot, so the access token is fetched once and refreshed on expiry
+            auth_manager = SpotifyClientCredentials(client_id=self.client_id,
+                                                    client_secret=self.client_secret,
+                                                    cache_handler=MemoryCacheHandler())
+            self._sp = spotipy.Spotify(auth_manager=auth_manager, retries=3, requests_timeout=10)
+        return self._sp
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        with metrics.timed(metrics.extract_seconds, backend='spotify_api'):
+            return await loop.run_in_executor(self._pool, partial(getattr(self._client(), method), *args, **kwargs))
+
+    async def iter_track_queries(self, spotify_url):
+        """Yield lists of "Song Artist" queries in playlist/album order, one page at a time"""
+        if not self.available:
+            return
+
+        try:
+            if "track" in spotify_url and "playlist" not in spotify_url:
+                track = await self._call('track', spotify_url)
+                yield [track_query(track)]
+
+            elif "playlist" in spotify_url:
+                fetch = partial(self._call, 'playlist_items', spotify_url,
+                                fields='items(track(name,artists(name))),total',
+                                limit=PLAYLIST_PAGE_SIZE, additional_types=('track',))
+                async for page in self._pages(fetch, PLAYLIST_PAGE_SIZE):
+                    yield [track_query(item['track']) for item in page if item.get('track')]
+
+            elif "album" in spotify_url:
+                fetch = partial(self._call, 'album_tracks', spotify_url, limit=ALBUM_PAGE_SIZE)
+                async for page in self._pages(fetch, ALBUM_PAGE_SIZE):
+                    yield [track_query(item) for item in page]
 
+        except Exception as e:
+            print("Spotify API error:", e)
+
+    async def _pages(self, fetch, page_size):
+        """First page tells us the total; the rest are requested concurrently and yielded in order"""
+        first = await fetch(offset=0)
+        yield first.get('items', [])
+
+        rest = [asyncio.ensure_future(fetch(offset=offset))
+                for offset in range(page_size, first.get('total') or 0, page_size)]
+        try:
+            for page in rest:
+                yield (await page).get('items', [])
+        finally:
+            for page in rest:
+                page.cancel()
+
+
+def _scrape_session():
+    """Shared keep-alive session for Spotify page requests"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60),
+                                         timeout=aiohttp.ClientTimeout(total=10),
+                                         headers=SCRAPE_HEADERS)
+    return _session
+
+
+async def _read_head(url):
+    """Read the page only until its <head> (and the meta tags in it) is complete"""
+    async with _scrape_session().get(url) as response:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')  # Chunks can split characters
+        page = ''
+        read = 0
+        async for chunk in response.content.iter_chunked(16 * 1024):
+            read += len(chunk)
+            page += decoder.decode(chunk)
+            if '</head>' in page or read >= SCRAPE_MAX_BYTES:
+                break
+        return page
+
+
+def _search_term(page):
+    meta = {name.lower(): html.unescape(value) for name, value in _meta_tag.findall(page)}
+    title = meta.get('og:title') or meta.get('twitter:title')
+    if not title:
+        match = _title_tag.search(page)
+        title = html.unescape(match.group(1)) if match else None
+    if title:
+        # Clean up the title
+        title = title.replace('| Spotify', '').replace('Spotify', '').strip()
+        title = _title_suffix.sub('', _title_prefix.sub('', title).strip()).strip()
+        if len(title) <= 3:  # Ensure it's not too short
+            title = None
+
+    # og:description is "Artist · Album · Song · Year" (older pages: "... by Artist")
+    artist = None
+    description = meta.get('og:description') or meta.get('twitter:description') or ''
+    legacy = _legacy_artist.search(description)
+    if legacy:
+        artist = legacy.group(1).strip()
+    elif ' · ' in description:
+        artist = description.split(' · ')[0].strip()
+
+    if title and artist:
+        return f"{title} {artist}"
+    return title
+
+
+async def extract_spotify_title(spotify_url):
+    """Try to extract song title and artist from a Spotify link (no API needed)"""
+    id_match = _track_id.search(spotify_url)
+    key = id_match.group(1) if id_match else spotify_url
+    if key in _titles:
+        _titles.move_to_end(key)
+        return _titles[key]
+
+    try:
+        with metrics.timed(metrics.extract_seconds, backend='spotify_page'):
+            page = await _read_head(spotify_url)
+        term = _search_term(page)
     except Exception as e:
-        print("Error while processing Spotify URL:", e)
-    return urls
+        print(f"Spotify title extraction error: {e}")
+        term = None
+
+    if term:
+        _titles[key] = term
+        if len(_titles) > TITLE_CACHE_SIZE:
+            _titles.popitem(last=False)
+        return term
+
+    # Try to extract from URL itself as last resort
+    if id_match:
+        return f"spotify track {id_match.group(1)}"
+    return None
@@ -0,0 +1,69 @@
+import queue
+import sqlite3
+import threading
+
+READ_TIMEOUT = 0.05  # Seconds a read on the event loop may wait for a lock before it counts as a miss
+
+
+def connect(path, *, timeout=5.0):
+    """WAL-mode connection usable from any thread (callers serialize their own access)"""
+    db = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None,
+                         uri=path.startswith('file:'))
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+def shared_path(path, name):
+    """':memory:' is a separate database per connection; the reader and writer need the same one"""
+    return f'file:{name}?mode=memory&cache=shared' if path == ':memory:' else path
+
+
+class SQLiteWriter:
+    """One thread that runs a database's writes in order.
+
+    In cluster mode several processes write the same cache files, and a write
+    can wait seconds for another process's lock. Queued here, that wait happens
+    on this thread instead of the bot's event loop. Failed writes are logged and
+    dropped: they only ever cost a cache entry.
+    """
+
+    def __init__(self, path, *, name):
+        self.path = path
+        self.name = name
+        self._writes = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_loop, name=name, daemon=True)
+        self._thread.start()
+
+    def execute(self, sql, params=()):
+        self._writes.put((sql, params))
+
+    def call(self, fn):
+        """Run fn(db) on the writer thread"""
+        self._writes.put((fn, None))
+
+    def flush(self, timeout=10):
+        """Wait until everything queued so far has been written"""
+        done = threading.Event()
+        self._writes.put((done, None))
+        return done.wait(timeout)
+
+    def close(self):
+        """Finish pending writes"""
+        self._writes.put(None)
+        self._thread.join(timeout=10)
+
+    def _write_loop(self):
+        db = connect(self.path)
+        while (item := self._writes.get()) is not None:
+            op, params = item
+            try:
+                if isinstance(op, threading.Event):
+                    op.set()
+                elif callable(op):
+                    op(db)
+                else:
+                    db.execute(op, params)
+            except sqlite3.Error as e:
+                print(f"{self.name} write error: {e}")
+        db.close()
@@ -0,0 +1,135 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+from sqlite_writer import READ_TIMEOUT, SQLiteWriter, connect, shared_path
+
+# Some googlevideo URLs carry the expiry in the path instead of the query (.../expire/1700000000/...)
+_path_expire = re.compile(r'/expire/(\d+)')
+
+# All playback and display need from a yt-dlp info dict. The full dict (formats,
+# captions, subtitles...) runs to hundreds of KB per video.
+PLAYBACK_FIELDS = ('id', 'url', 'acodec', 'abr', 'http_headers', 'title', 'duration', 'thumbnail', 'webpage_url')
+
+
+def playback_info(data):
+    """The PLAYBACK_FIELDS of a yt-dlp info dict"""
+    return {field: data[field] for field in PLAYBACK_FIELDS if data.get(field) is not None}
+
+
+class StreamCache:
+    """In-memory video ID -> resolved stream info (playback_info), valid until the stream URL's own expire= time
+
+    With a path, entries are also written to SQLite so other processes on the
+    same host (cluster mode) reuse each other's resolves: memory is checked
+    first, then the file. Writes go through a writer thread and a failed read
+    is a miss, so another process holding the lock never stalls the event loop.
+    googlevideo URLs are tied to the IP that resolved them, so only share the
+    file between processes behind the same address.
+    """
+
+    def __init__(self, path=None, *, refresh_margin=15 * 60, default_ttl=3 * 3600, max_entries=5000):
+        self.refresh_margin = refresh_margin  # Treat URLs this close to expiry as stale
+        self.default_ttl = default_ttl  # Used when a URL has no expire parameter
+        self.max_entries = max_entries
+        self.hits = 0
+        self.shared_hits = 0  # Hits found in the file (resolved by another process or before a restart)
+        self.misses = 0
+        self._entries = OrderedDict()  # video_id -> (expires_at, data)
+        self._db = None
+        self._writer = None
+        self._puts = 0
+        self._lock = threading.Lock()
+        if path:
+            path = shared_path(path, f'stream_cache_{id(self)}')
+            self._db = connect(path)
+            self._db.execute('''CREATE TABLE IF NOT EXISTS streams (
+                video_id TEXT PRIMARY KEY,
+                expires REAL NOT NULL,
+                data TEXT NOT NULL)''')
+            self._db.execute(f'PRAGMA busy_timeout = {int(READ_TIMEOUT * 1000)}')
+            self._writer = SQLiteWriter(path, name='stream-cache')
+
+    def expiry_of(self, data):
+        url = data.get('url') or ''
+        expire = parse_qs(urlparse(url).query).get('expire')
+        if expire and expire[0].isdigit():
+            return int(expire[0])
+        match = _path_expire.search(url)
+        if match:
+            return int(match.group(1))
+        return time.time() + self.default_ttl
+
+    def is_fresh(self, data, expires_at=None):
+        """True if the stream URL outlives the refresh margin and the whole track.
+
+        Tracks longer than a fresh URL lives (10-hour loops) can't outlive it, and
+        re-resolving wouldn't help; for those, a URL with most of its life left will do.
+        """
+        if not data or not data.get('url'):
+            return False
+        if expires_at is None:
+            expires_at = self.expiry_of(data)
+        whole_track = (data.get('duration') or 0) + 60
+        needed = max(self.refresh_margin, min(whole_track, self.default_ttl - self.refresh_margin))
+        return expires_at - time.time() > needed
+
+    def get(self, video_id):
+        entry = self._entries.get(video_id)
+        if entry is not None and not self.is_fresh(entry[1], entry[0]):
+            del self._entries[video_id]
+            entry = None
+        if entry is None and self._db is not None:
+            entry = self._load(video_id)
+            if entry is not None:
+                self.shared_hits += 1
+                self._remember(video_id, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(video_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, data):
+        video_id = data.get('id')
+        if not video_id or not data.get('url'):
+            return
+        data = playback_info(data)
+        entry = (self.expiry_of(data), data)
+        self._remember(video_id, entry)
+        if self._writer is not None:
+            self._writer.execute('INSERT OR REPLACE INTO streams VALUES (?, ?, ?)', (video_id, entry[0], json.dumps(data)))
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._writer.execute('DELETE FROM streams WHERE expires < ?', (time.time(),))
+
+    def close(self):
+        """Finish pending writes"""
+        if self._writer is not None:
+            self._writer.close()
+
+    def _load(self, video_id):
+        try:
+            with self._lock:
+                row = self._db.execute('SELECT expires, data FROM streams WHERE video_id = ?', (video_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Stream cache read error: {e}")
+            return None  # Locked by another process: resolve it again instead of waiting
+        if row is None:
+            return None
+        data = json.loads(row[1])
+        return (row[0], data) if self.is_fresh(data, row[0]) else None
+
+    def _remember(self, video_id, entry):
+        self._entries[video_id] = entry
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
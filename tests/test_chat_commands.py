@@ -0,0 +1,123 @@
+"""Chat commands ("@Miku play ...") run through PseudoCtx, not commands.Context: drive them
+through on_message against the benchmark fakes."""
+import asyncio
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(here), os.path.join(os.path.dirname(here), 'benchmarks')]
+os.environ.setdefault('SEARCH_CACHE_PATH', ':memory:')
+os.environ['EXTRACT_POOL'] = 'thread'  # The fakes are patched into this process only
+os.environ['QUEUE_SNAPSHOTS'] = '0'
+
+import main  # noqa: E402
+import fakes  # noqa: E402
+
+_guild_ids = iter(range(5000, 10 ** 9))
+_loop = asyncio.new_event_loop()  # One loop for every test, like the bot's: the extractor's dispatchers live on it
+
+
+class RecordingChannel(fakes.FakeChannel):
+    def __init__(self, guild):
+        super().__init__(guild)
+        self.messages = []
+
+    async def send(self, content=None, *, embed=None, view=None):
+        sent = await super().send(content, embed=embed, view=view)
+        self.messages.append(sent)
+        return sent
+
+
+def new_ctx():
+    ctx = fakes.FakeCtx(next(_guild_ids))
+    ctx.channel = ctx.author.voice.channel = RecordingChannel(ctx.guild)
+    return ctx
+
+
+async def say(ctx, text):
+    await main.on_message(fakes.FakeMessage(main.bot.user, ctx, text))
+
+
+async def until(condition, timeout=30):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def run(scenario):
+    async def wrapper():
+        fakes.Latency.extract = fakes.Latency.spotify = 0.001
+        fakes.Latency.track = 30
+        fakes.install(main)
+        loop = asyncio.get_running_loop()
+        errors = []
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+        await asyncio.wait_for(scenario(), 60)
+        assert not errors, errors
+    _loop.run_until_complete(wrapper())
+
+
+def texts(ctx):
+    return [(sent.content or '') + (sent.embed.description or '' if sent.embed else '') for sent in ctx.channel.messages]
+
+
+def test_chat_spotify_playlist_reports_progress_and_result():
+    async def scenario():
+        ctx = new_ctx()
+        guild_player = main.get_player(ctx.guild.id)
+        await say(ctx, "play https://open.spotify.com/playlist/N12")
+        await until(lambda: not guild_player.fills)
+        status = ctx.channel.messages[0]  # Edited as tracks are matched, then into the result
+        assert status.embed is not None and "Added **12** tracks" in status.embed.description
+        assert not any('Oopsie' in text for text in texts(ctx))
+        await main.stop(ctx)
+        main.idle_scheduler.cancel(ctx.guild.id)
+    run(scenario)
+
+
+def test_chat_spotify_playlist_stopped_midway():
+    async def scenario():
+        ctx = new_ctx()
+        guild_player = main.get_player(ctx.guild.id)
+        fakes.Latency.extract = 0.05
+        await say(ctx, "play https://open.spotify.com/playlist/N200")
+        fills = set(guild_player.fills)
+        await say(ctx, "stop")
+        await asyncio.wait(fills)
+        status = ctx.channel.messages[0]
+        assert 'stopped' in status.content
+        main.idle_scheduler.cancel(ctx.guild.id)
+    run(scenario)
+
+
+def test_stop_does_not_wait_for_the_first_spotify_match():
+    async def scenario():
+        ctx = new_ctx()
+        guild_player = main.get_player(ctx.guild.id)
+        fakes.Latency.extract = 0.5  # Each search attempt for the first track
+        main.search_cache.clear()  # Earlier tests matched the same fake songs
+        play = asyncio.create_task(say(ctx, "play https://open.spotify.com/playlist/N50"))
+        await until(lambda: guild_player.fills)
+        start = asyncio.get_running_loop().time()
+        await say(ctx, "stop")
+        assert asyncio.get_running_loop().time() - start < 0.2
+        await play
+        assert not ctx.voice_client.started  # Stopped before anything was queued
+        main.idle_scheduler.cancel(ctx.guild.id)
+    run(scenario)
+
+
+def test_chat_queue_sends_pages():
+    async def scenario():
+        ctx = new_ctx()
+        guild_player = main.get_player(ctx.guild.id)
+        await say(ctx, "play https://www.youtube.com/playlist?list=N40")
+        await until(lambda: not guild_player.fills)
+        await say(ctx, "queue")
+        sent = ctx.channel.messages[-1]
+        assert sent.view is not None, sent.content  # More than one page: the buttons came along
+        assert "Page 1" in sent.embed.footer.text
+        await main.stop(ctx)
+        main.idle_scheduler.cancel(ctx.guild.id)
+    run(scenario)
@@ -0,0 +1,144 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from track_queue import TrackQueue  # noqa: E402
+
+
+class SmallChunks(TrackQueue):
+    CHUNK = 4  # Splits at 8, merges below 1: a few dozen tracks already span many chunks
+
+
+class Song:
+    def __init__(self, n, duration=None):
+        self.n = n
+        self.duration = duration
+
+    def __repr__(self):
+        return f"Song({self.n})"
+
+
+def check(queue, expected):
+    """Same tracks in the same order, and the chunk bookkeeping agrees with it"""
+    assert len(queue) == len(expected)
+    assert bool(queue) == bool(expected)
+    assert list(queue) == expected
+    assert [queue[i] for i in range(len(expected))] == expected
+    assert queue._len == sum(map(len, queue._chunks))
+    assert all(queue._chunks), "no empty chunks"
+    assert all(len(chunk) <= 2 * queue.CHUNK for chunk in queue._chunks)
+    for i in range(len(queue._chunks)):
+        # Prefix sums from the Fenwick tree match the chunk sizes
+        node, total = i + 1, 0
+        while node:
+            total += queue._tree[node]
+            node -= node & -node
+        assert total == sum(len(chunk) for chunk in queue._chunks[:i + 1])
+
+
+@pytest.mark.parametrize('cls, size', [(SmallChunks, 0), (SmallChunks, 37), (TrackQueue, 0), (TrackQueue, 1200)])
+def test_mixed_operations_match_a_list(cls, size):
+    rng = random.Random(size)
+    counter = iter(range(10 ** 9))
+    expected = [Song(next(counter)) for _ in range(size)]
+    queue = cls(expected)
+    check(queue, expected)
+
+    for step in range(2000):
+        op = rng.choice(['append', 'extend', 'insert', 'insert', 'pop', 'pop', 'popleft', 'del', 'move', 'move'])
+        if op == 'append':
+            song = Song(next(counter))
+            queue.append(song)
+            expected.append(song)
+        elif op == 'extend':
+            songs = [Song(next(counter)) for _ in range(rng.randrange(queue.CHUNK * 3))]
+            queue.extend(songs)
+            expected.extend(songs)
+        elif op == 'insert':
+            index = rng.randrange(len(expected) + 2)
+            song = Song(next(counter))
+            queue.insert(index, song)
+            expected.insert(index, song)
+        elif not expected:
+            continue
+        elif op == 'pop':
+            index = rng.randrange(-len(expected), len(expected))
+            assert queue.pop(index) is expected.pop(index)
+        elif op == 'popleft':
+            assert queue.popleft() is expected.pop(0)
+        elif op == 'del':
+            index = rng.randrange(len(expected))
+            del queue[index]
+            del expected[index]
+        elif op == 'move':
+            source, destination = rng.randrange(len(expected)), rng.randrange(len(expected))
+            song = expected.pop(source)
+            expected.insert(destination, song)
+            assert queue.move(source, destination) is song
+        if step % 100 == 0:
+            check(queue, expected)
+    check(queue, expected)
+
+
+@pytest.mark.parametrize('cls', [SmallChunks, TrackQueue])
+def test_slices_across_chunk_boundaries(cls):
+    expected = [Song(n) for n in range(cls.CHUNK * 5 + 3)]
+    queue = cls(expected)
+    for i in range(0, len(expected), 7):
+        queue.insert(i, expected[i])  # Uneven chunk sizes
+        expected.insert(i, expected[i])
+    for start in range(-2, len(expected) + 2, 3):
+        for stop in range(max(0, start), len(expected) + 3, 5):
+            assert queue.slice(start, stop) == expected[max(0, start):stop]
+    assert queue[3:len(expected) - 3] == expected[3:len(expected) - 3]
+    assert queue[::2] == expected[::2]
+
+
+@pytest.mark.parametrize('cls', [SmallChunks, TrackQueue])
+def test_shuffle_keeps_every_track(cls):
+    expected = [Song(n) for n in range(cls.CHUNK * 6 + 1)]
+    queue = cls(expected)
+    queue.shuffle(random.Random(1))
+    assert sorted(queue, key=lambda song: song.n) == expected
+    assert list(queue) != expected
+    check(queue, list(queue))
+
+
+def test_index_errors():
+    queue = SmallChunks([Song(n) for n in range(10)])
+    for index in (10, -11):
+        with pytest.raises(IndexError):
+            queue[index]
+        with pytest.raises(IndexError):
+            queue.pop(index)
+    with pytest.raises(IndexError):
+        queue.move(0, 10)
+    check(queue, list(queue))  # A failed move leaves the queue alone
+    queue.clear()
+    with pytest.raises(IndexError):
+        queue.popleft()
+    check(queue, [])
+
+
+def test_duration_follows_changes():
+    songs = [Song(n, duration=n % 5 or None) for n in range(40)]
+    queue = SmallChunks(songs)
+
+    def expected():
+        durations = [song.duration for song in queue]
+        return sum(filter(None, durations)), durations.count(None)
+
+    assert queue.duration() == expected()
+    queue.pop(3)
+    queue.insert(17, Song(100, duration=60))
+    queue.move(30, 0)
+    queue.extend([Song(101, duration=7), Song(102)])
+    assert queue.duration() == expected()
+    queue.shuffle(random.Random(2))
+    assert queue.duration() == expected()
+    queue.clear()
+    assert queue.duration() == (0, 0)
@@ -0,0 +1,221 @@
+import itertools
+import random
+
+
+class TrackQueue:
+    """A guild's upcoming Tracks: a list of chunks plus a Fenwick tree over the chunk sizes.
+
+    Finding position i walks the tree (O(log n)) and then indexes one chunk,
+    so get/remove/insert/move at any position cost O(log n + CHUNK) instead of
+    the O(n) of a deque or list. Slices for display only touch the chunks they
+    cover. Shuffle is one O(n) Fisher-Yates pass over a flat copy, not the
+    O(n^2) of shuffling a deque in place. Supports the deque operations the bot
+    already used (append, extend, popleft, clear, indexing, del, iteration).
+
+    Each chunk also caches the total duration of its tracks. Changing a chunk
+    only marks its sum stale, and duration() re-adds just the stale chunks, so
+    the queue's total length never needs a pass over every track. Tracks
+    resolved by the prefetcher (which fills in missing durations) sit in the
+    head chunk, which playback keeps marking stale anyway.
+    """
+
+    CHUNK = 256  # Chunks split at 2 * CHUNK and merge into a neighbour below CHUNK / 4
+
+    def __init__(self, tracks=()):
+        self._chunks = []
+        self._tree = [0]  # Fenwick tree over len(chunk), 1-based
+        self._top = 0
+        self._sums = []  # Per chunk: (seconds, tracks without a duration), or None if stale
+        self._len = 0
+        self.extend(tracks)
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.slice(*index.indices(self._len)[:2]) if index.step in (None, 1) else list(self)[index]
+        chunk, offset = self._locate(self._position(index))
+        return self._chunks[chunk][offset]
+
+    def __delitem__(self, index):
+        self.pop(index)
+
+    def __repr__(self):
+        return f"TrackQueue({self._len} tracks)"
+
+    # -- Reading
+
+    def slice(self, start, stop):
+        """Tracks[start:stop] as a list, touching only the chunks in range"""
+        start, stop = max(0, start), min(stop, self._len)
+        if start >= stop:
+            return []
+        chunk, offset = self._locate(start)
+        result = []
+        while len(result) < stop - start:
+            result += self._chunks[chunk][offset:offset + stop - start - len(result)]
+            chunk, offset = chunk + 1, 0
+        return result
+
+    def duration(self):
+        """(total seconds of the tracks with a known duration, number of tracks without one)"""
+        seconds = unknown = 0
+        for i, cached in enumerate(self._sums):
+            if cached is None:
+                durations = [track.duration for track in self._chunks[i]]
+                cached = self._sums[i] = (sum(filter(None, durations)), durations.count(None))
+            seconds += cached[0]
+            unknown += cached[1]
+        return seconds, unknown
+
+    # -- Adding
+
+    def append(self, track):
+        if not self._chunks or len(self._chunks[-1]) >= self.CHUNK:
+            self._chunks.append([track])
+            self._sums.append(None)
+            self._rebuild()
+        else:
+            self._chunks[-1].append(track)
+            self._sums[-1] = None
+            self._add(len(self._chunks) - 1, 1)
+        self._len += 1
+
+    def extend(self, tracks):
+        tracks = list(tracks)
+        if not tracks:
+            return
+        if self._chunks and len(self._chunks[-1]) < self.CHUNK:
+            room = self.CHUNK - len(self._chunks[-1])
+            self._chunks[-1] += tracks[:room]
+            self._sums[-1] = None
+            tracks = tracks[room:]
+        added = [tracks[i:i + self.CHUNK] for i in range(0, len(tracks), self.CHUNK)]
+        self._chunks += added
+        self._sums += [None] * len(added)
+        self._len = sum(map(len, self._chunks))
+        self._rebuild()
+
+    def insert(self, index, track):
+        """Insert before position index (0 = up next); past the end appends"""
+        if index >= self._len or not self._chunks:
+            self.append(track)
+            return
+        chunk, offset = self._locate(max(0, index))
+        self._chunks[chunk].insert(offset, track)
+        self._sums[chunk] = None
+        self._len += 1
+        if len(self._chunks[chunk]) > 2 * self.CHUNK:
+            self._split(chunk)
+        else:
+            self._add(chunk, 1)
+
+    # -- Removing
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError("pop from an empty queue")
+        return self.pop(0)
+
+    def pop(self, index=-1):
+        chunk, offset = self._locate(self._position(index))
+        track = self._chunks[chunk].pop(offset)
+        self._sums[chunk] = None
+        self._len -= 1
+        if not self._chunks[chunk] or (len(self._chunks[chunk]) < self.CHUNK // 4 and len(self._chunks) > 1):
+            self._merge(chunk)
+        else:
+            self._add(chunk, -1)
+        return track
+
+    def clear(self):
+        self._chunks = []
+        self._tree = [0]
+        self._top = 0
+        self._sums = []
+        self._len = 0
+
+    # -- Reordering
+
+    def move(self, source, destination):
+        """Move the track at source so it ends up at destination; returns it"""
+        source, destination = self._position(source), self._position(destination)
+        track = self.pop(source)
+        self.insert(destination, track)
+        return track
+
+    def shuffle(self, rng=random):
+        tracks = list(self)
+        rng.shuffle(tracks)
+        self.clear()
+        self.extend(tracks)
+
+    # -- Internals
+
+    def _position(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        return index
+
+    def _locate(self, index):
+        """(chunk number, offset in chunk) of position index, by descending the Fenwick tree"""
+        if index < len(self._chunks[0]):
+            return 0, index  # The head of the queue: what playback, prefetch and !queue look at
+        tree, size = self._tree, len(self._tree)
+        chunk, remaining = 0, index
+        step = self._top
+        while step:
+            node = chunk + step
+            if node < size and tree[node] <= remaining:
+                chunk = node
+                remaining -= tree[node]
+            step >>= 1
+        return chunk, remaining
+
+    def _add(self, chunk, delta):
+        tree, size = self._tree, len(self._tree)
+        node = chunk + 1
+        while node < size:
+            tree[node] += delta
+            node += node & -node
+
+    def _rebuild(self):
+        """Rebuild the tree after chunks were added or removed: O(number of chunks)"""
+        tree = [0] + [len(chunk) for chunk in self._chunks]
+        for node in range(1, len(tree)):
+            parent = node + (node & -node)
+            if parent < len(tree):
+                tree[parent] += tree[node]
+        self._tree = tree
+        self._top = 1 << (len(tree) - 1).bit_length() >> 1  # Largest power of two <= number of chunks
+
+    def _split(self, chunk):
+        items = self._chunks[chunk]
+        self._chunks[chunk:chunk + 1] = [items[:len(items) // 2], items[len(items) // 2:]]
+        self._sums[chunk:chunk + 1] = [None, None]
+        self._rebuild()
+
+    def _merge(self, chunk):
+        """Fold an emptied or undersized chunk into its neighbour"""
+        items = self._chunks.pop(chunk)
+        del self._sums[chunk]
+        if items:
+            neighbour = max(0, chunk - 1)
+            self._sums[neighbour] = None
+            if chunk > 0:
+                self._chunks[neighbour] += items
+            else:
+                self._chunks[0][:0] = items
+            if len(self._chunks[neighbour]) > 2 * self.CHUNK:
+                self._split(neighbour)
+                return
+        self._rebuild()